@@ -0,0 +1,345 @@
+# coding: utf-8
+# 合成した日誌エクセルファイルで、復元の各段階の処理時間とメモリ使用量を計測する
+
+import argparse
+import json
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+from typing import List, Optional, Any, Dict, Tuple, Callable
+
+import openpyxl
+from openpyxl.cell.rich_text import CellRichText, TextBlock
+from openpyxl.cell.text import InlineFont
+
+import main
+from main import (
+  REIWA_POS, MONTH_POS, DAY_POS, WEATHER_POS, TEMPERATURE_POS, HUMIDITY_POS, RECORDER_POS,
+  INSPECTIONS_POS, ACTIVITIES_POS, DAY_FLOWS_POS, HOME_CONTACTS_POS, NEAR_MISSES_POS, PROFILES_POS,
+  NAME_COL, ATTEND_COL, REASON_COL, MEDICINE_COL, EXCRETION_COL, EATING_COL, SLEEPING_COL, OVERVIEW_COL,
+  VALID_ABSENCE_REASONS, VALID_WEATHERS, VALID_ATTENDANCE, VALID_MEDICINE, VALID_EXCRETION,
+  VALID_EATING, VALID_SLEEPING, SHEET_NAME,
+)
+
+BENCH_REIWA = 6
+BENCH_START_MONTH = 4
+# 復元.batの起動 (モジュールの読み込みとヘルプの表示) にかけてよい時間の上限
+STARTUP_BUDGET_SECONDS = 0.3
+# 起動時に読み込まれてはいけない重いモジュール (実際に使うときに読み込む)
+STARTUP_LAZY_MODULES = ("openpyxl", "multiprocessing", "sqlite3")
+TEXT_CHARS = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+
+def randomText(rnd: random.Random, length: int) -> str:
+  return "".join(rnd.choice(TEXT_CHARS) for _ in range(max(length, 1)))
+
+def iterBenchDates(days: int) -> List[Tuple[int, int, int]]:
+  # 4月1日から順に、令和年度の範囲で日付を並べる
+  dates: List[Tuple[int, int, int]] = []
+  reiwa = BENCH_REIWA
+  month = BENCH_START_MONTH
+  day = 1
+  while len(dates) < days:
+    dates.append((reiwa, month, day))
+    day += 1
+    if day > main.getNumberOfDays(reiwa, month):
+      day = 1
+      month = month % 12 + 1
+      if month == BENCH_START_MONTH:
+        reiwa += 1
+  return dates
+
+def writeSyntheticSheet(xlsx_path: Path, reiwa: int, month: int, day: int, children: int,
+                        text_length: int, rnd: random.Random):
+  """main.pyのセル位置の定数どおりに値を入れた日誌エクセルファイルを作る"""
+  wb = buildSyntheticSheet(reiwa, month, day, children, text_length, rnd)
+  wb.save(str(xlsx_path))
+
+def buildSyntheticSheet(reiwa: int, month: int, day: int, children: int, text_length: int,
+                        rnd: random.Random) -> openpyxl.Workbook:
+  wb = openpyxl.Workbook()
+  sheet = wb.active
+  sheet.title = SHEET_NAME
+  sheet.cell(*REIWA_POS).value = reiwa
+  sheet.cell(*MONTH_POS).value = month
+  sheet.cell(*DAY_POS).value = day
+  sheet.cell(*WEATHER_POS).value = rnd.choice(sorted(VALID_WEATHERS))
+  sheet.cell(*TEMPERATURE_POS).value = f"{rnd.randint(0, 39)}℃"
+  sheet.cell(*HUMIDITY_POS).value = f"{rnd.randint(20, 100)}％"
+  sheet.cell(*RECORDER_POS).value = randomText(rnd, 4)
+  n_items = max(text_length // 10, 1)
+  sheet.cell(*INSPECTIONS_POS).value = ", ".join(f"{randomText(rnd, 4)}: {randomText(rnd, text_length)}" for _ in range(n_items))
+  sheet.cell(*ACTIVITIES_POS).value = ", ".join(randomText(rnd, text_length) for _ in range(n_items))
+  sheet.cell(*DAY_FLOWS_POS).value = ", ".join(f"[{rnd.randint(7, 18)}時{rnd.randint(0, 59)}分]{randomText(rnd, text_length)}" for _ in range(n_items))
+  sheet.cell(*HOME_CONTACTS_POS).value = ", ".join(randomText(rnd, text_length) for _ in range(n_items))
+  sheet.cell(*NEAR_MISSES_POS).value = randomText(rnd, text_length)
+  absence_reasons = sorted(VALID_ABSENCE_REASONS)
+  for i in range(children):
+    row = PROFILES_POS[0] + i
+    sheet.cell(row, NAME_COL).value = f"園児{i + 1}"
+    sheet.cell(row, ATTEND_COL).value = rnd.choice(list(VALID_ATTENDANCE))
+    sheet.cell(row, REASON_COL).value = rnd.choice(absence_reasons)
+    sheet.cell(row, MEDICINE_COL).value = rnd.choice(list(VALID_MEDICINE))
+    sheet.cell(row, EXCRETION_COL).value = rnd.choice(list(VALID_EXCRETION))
+    sheet.cell(row, EATING_COL).value = rnd.choice(list(VALID_EATING))
+    sheet.cell(row, SLEEPING_COL).value = rnd.choice(list(VALID_SLEEPING))
+    sheet.cell(row, OVERVIEW_COL).value = randomText(rnd, text_length)
+  return wb
+
+def generateWorkload(out_dir: Path, days: int, children: int, text_length: int, seed: int = 0) -> List[Path]:
+  rnd = random.Random(seed)
+  xlsx_paths: List[Path] = []
+  for reiwa, month, day in iterBenchDates(days):
+    xlsx_path = out_dir.joinpath(f"{reiwa:02d}{month:02d}{day:02d}.xlsx")
+    writeSyntheticSheet(xlsx_path, reiwa, month, day, children, text_length, rnd)
+    xlsx_paths.append(xlsx_path)
+  return xlsx_paths
+
+# 読み込みエンジンの一致を確かめる日誌の種類 (1枚に1つずつ、セルの値の扱いが分かれやすい形を入れる)
+# openpyxlは文字列をインライン文字列で書くので、"plain"がインライン文字列、"shared_strings"が共有文字列の確認になる
+PARITY_VARIANTS = ("plain", "shared_strings", "numbers", "booleans", "formulas", "invalid_codes",
+                   "terminator_row", "rich_text", "escaped_text", "blank_cells", "custom_formats")
+
+def toSharedStrings(xlsx_path: Path):
+  """openpyxlが書くインライン文字列のセルを、エクセルと同じ共有文字列 (t="s") に書き換える
+  一部の文字列は書式の区切り (<r>) で分け、どの文字列にもふりがな (<rPh>) を付ける。数値のセルには日付でない書式を付ける"""
+  with zipfile.ZipFile(str(xlsx_path)) as zf:
+    parts = {info.filename: zf.read(info.filename) for info in zf.infolist()}
+  strings: List[str] = []
+  def shared(match: "re.Match[str]") -> str:
+    content = match.group(3)
+    plain = re.fullmatch(r"<t>(.+)</t>", content, re.S)
+    if plain is not None and len(strings) % 3 == 0:
+      text = plain.group(1)
+      content = f"<r><t>{text[:1]}</t></r><r><t>{text[1:]}</t></r>"
+    strings.append(f'<si>{content}<rPh sb="0" eb="1"><t>フリガナ</t></rPh></si>')
+    return f'<c {match.group(1)}t="s" s="1"{match.group(2)}><v>{len(strings) - 1}</v></c>'
+  sheet_xml = parts["xl/worksheets/sheet1.xml"].decode("utf-8")
+  sheet_xml = re.sub(r'<c ([^>]*?)t="inlineStr"([^>]*)><is>(.*?)</is></c>', shared, sheet_xml)
+  parts["xl/worksheets/sheet1.xml"] = sheet_xml.replace('t="n">', 't="n" s="1">').encode("utf-8")
+  parts["xl/sharedStrings.xml"] = ('<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                                   + "".join(strings) + "</sst>").encode("utf-8")
+  parts["xl/_rels/workbook.xml.rels"] = parts["xl/_rels/workbook.xml.rels"].replace(
+    b"</Relationships>", b'<Relationship Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" '
+                         b'Target="sharedStrings.xml" Id="rIdShared" /></Relationships>')
+  parts["[Content_Types].xml"] = parts["[Content_Types].xml"].replace(
+    b"</Types>", b'<Override PartName="/xl/sharedStrings.xml" '
+                 b'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/></Types>')
+  # 書式1は数値 ("0") の書式で、日付の書式ではない
+  parts["xl/styles.xml"] = re.sub(rb'<cellXfs count="1">(<xf [^>]*/>)</cellXfs>',
+                                  rb'<cellXfs count="2">\1<xf numFmtId="1" fontId="0" fillId="0" borderId="0" xfId="0" /></cellXfs>',
+                                  parts["xl/styles.xml"])
+  with zipfile.ZipFile(str(xlsx_path), "w", zipfile.ZIP_DEFLATED) as zf:
+    for name, data in parts.items():
+      zf.writestr(name, data)
+
+def writeParitySheet(xlsx_path: Path, variant: str, day: int, children: int, text_length: int, rnd: random.Random):
+  wb = buildSyntheticSheet(BENCH_REIWA, BENCH_START_MONTH, day, children, text_length, rnd)
+  sheet = wb[SHEET_NAME]
+  first = PROFILES_POS[0]
+  if variant == "numbers":
+    sheet.cell(*TEMPERATURE_POS).value = 25
+    sheet.cell(*HUMIDITY_POS).value = 55.5
+    sheet.cell(*RECORDER_POS).value = 1234567890123
+    sheet.cell(first, OVERVIEW_COL).value = 0.1
+    sheet.cell(first + 1, OVERVIEW_COL).value = 1e-7
+  elif variant == "booleans":
+    sheet.cell(*RECORDER_POS).value = True
+    sheet.cell(*NEAR_MISSES_POS).value = False
+    sheet.cell(first, ATTEND_COL).value = True
+  elif variant == "formulas":
+    sheet.cell(*RECORDER_POS).value = "=1+2"
+    sheet.cell(*NEAR_MISSES_POS).value = '=CONCATENATE("a","b")'
+    sheet.cell(first, OVERVIEW_COL).value = "=A1"
+  elif variant == "invalid_codes":
+    sheet.cell(first, ATTEND_COL).value = "??"
+    sheet.cell(first, MEDICINE_COL).value = 3
+    sheet.cell(first + 1, EXCRETION_COL).value = "   "
+    sheet.cell(first + 1, REASON_COL).value = "ちこく"
+    sheet.cell(*WEATHER_POS).value = "雪"
+    sheet.cell(*TEMPERATURE_POS).value = "abc"
+    sheet.cell(*DAY_FLOWS_POS).value = "x"
+  elif variant == "terminator_row":
+    # 名前が空白だけの行で一覧が終わり、その下の行は読まれない
+    sheet.cell(first + 2, NAME_COL).value = " "
+    sheet.cell(first + 4, NAME_COL).value = "一覧の外"
+  elif variant == "rich_text":
+    sheet.cell(*RECORDER_POS).value = CellRichText("記録", TextBlock(InlineFont(b=True), "者"))
+    sheet.cell(first, OVERVIEW_COL).value = CellRichText(TextBlock(InlineFont(i=True), "太字"), "と普通")
+  elif variant == "escaped_text":
+    sheet.cell(*RECORDER_POS).value = "a_x005F_b"
+    sheet.cell(first, OVERVIEW_COL).value = "改行\nと\tタブ"
+    sheet.cell(first + 1, OVERVIEW_COL).value = "<&>\"'"
+  elif variant == "custom_formats":
+    # 日付ではないユーザー定義の表示形式は、nativeエンジンでそのまま読めなければならない
+    sheet.cell(*REIWA_POS).number_format = '"令和"0"年度"'
+    sheet.cell(*MONTH_POS).number_format = '0"月"'
+    sheet.cell(*DAY_POS).number_format = '[Red]0"日";[Blue]-0'
+    sheet.cell(first, MEDICINE_COL).value = 2
+    sheet.cell(first, MEDICINE_COL).number_format = '0.0_);[Red](0.0)'
+  elif variant == "blank_cells":
+    for pos in (WEATHER_POS, TEMPERATURE_POS, HUMIDITY_POS, INSPECTIONS_POS, ACTIVITIES_POS):
+      sheet.cell(*pos).value = None
+    sheet.cell(first, OVERVIEW_COL).value = ""
+    sheet.cell(first + 1, REASON_COL).value = None
+  wb.save(str(xlsx_path))
+  if variant == "shared_strings":
+    toSharedStrings(xlsx_path)
+
+def checkParity(out_dir: Path, children: int, text_length: int, seed: int = 0) -> List[str]:
+  """nativeとopenpyxlの読み込みエンジンで、同じダンプと警告になるかを確かめ、違いを返す"""
+  rnd = random.Random(seed)
+  differences: List[str] = []
+  for day, variant in enumerate(PARITY_VARIANTS, 1):
+    xlsx_path = out_dir.joinpath(f"parity_{variant}.xlsx")
+    writeParitySheet(xlsx_path, variant, day, children, text_length, rnd)
+    # nativeで読めずにopenpyxlで読み直したのでは比べたことにならない
+    try:
+      main.loadNativeSheet(xlsx_path)
+    except main.XlsxFormatError as e:
+      differences.append(f"{variant}: nativeエンジンで読み込めません。({e})")
+      continue
+    native = main.tryParseXlsxToListen(xlsx_path, "native")
+    reference = main.tryParseXlsxToListen(xlsx_path, "openpyxl")
+    for label, index in (("日付", 0), ("ダンプ", 1), ("警告", 2)):
+      if native[index] != reference[index]:
+        differences.append(f"{variant}: {label}が異なります。\n  native:   {native[index]}\n  openpyxl: {reference[index]}")
+    if native[3].get("error") != reference[3].get("error"):
+      differences.append(f"{variant}: エラーが異なります。(native: {native[3].get('error')}, openpyxl: {reference[3].get('error')})")
+  return differences
+
+def measure(name: str, func: Callable[[], Any], results: List[Dict[str, Any]], n_items: int) -> Any:
+  tracemalloc.start()
+  start = time.perf_counter()
+  value = func()
+  elapsed = time.perf_counter() - start
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  results.append({"stage": name, "seconds": elapsed, "items": n_items, "peak_bytes": peak})
+  return value
+
+def loadSheet(xlsx_path: Path, engine: str) -> Any:
+  if engine == "native":
+    return main.loadNativeSheet(xlsx_path)
+  wb = openpyxl.load_workbook(str(xlsx_path))
+  return wb[SHEET_NAME]
+
+def runBenchmark(xlsx_paths: List[Path], engine: str, storage_dir: Path) -> List[Dict[str, Any]]:
+  results: List[Dict[str, Any]] = []
+  n = len(xlsx_paths)
+  measure("parseXlsx", lambda: [main.parseXlsx(p, engine) for p in xlsx_paths], results, n)
+  sheets = [loadSheet(p, engine) for p in xlsx_paths]
+  parsed = measure("createDiaryFromXlsxSheet", lambda: [main.createDiaryFromXlsxSheet(s) for s in sheets], results, n)
+  del sheets
+  dumps = measure("listenPage", lambda: [(page.dt, main.listenPage(page)) for page, _ in parsed], results, n)
+  # 奇数日を保存済み、偶数日を新しいデータとして月ごとに統合する
+  months: Dict[Tuple[int, int], Tuple[Dict[int, List[Any]], Dict[int, List[Any]]]] = {}
+  for dt, dump in dumps:
+    existing, new = months.setdefault((dt.reiwa, dt.month), ({}, {}))
+    (existing if dt.day % 2 == 1 else new)[dt.day] = dump
+  pairs = [(key, main.createSaveData(key[0], key[1], existing), new) for key, (existing, new) in months.items()]
+  # 書き出したファイルを読み直し、元のダンプと一致するか確かめる (往復)
+  export_dir = storage_dir.joinpath("export")
+  export_dir.mkdir()
+  mismatches = measure("exportDiaryDay", lambda: [main.exportDiaryDay(export_dir.joinpath(f"{i}.xlsx"), dt, dump, True, engine)
+                                                  for i, (dt, dump) in enumerate(dumps)], results, n)
+  if any(mismatch is not None for mismatch in mismatches):
+    raise RuntimeError("\n".join(mismatch for mismatch in mismatches if mismatch is not None))
+  marged = measure("mergeMonthlySave", lambda: [(key, main.mergeMonthlySave(a, b)[0]) for key, a, b in pairs], results, len(pairs))
+  measure("json save", lambda: saveThroughJournal(storage_dir, marged), results, len(marged))
+  return results
+
+def saveThroughJournal(storage_dir: Path, marged: List[Tuple[Tuple[int, int], List[Any]]]):
+  # 復元と同じく、ジャーナルに記録して一時ファイルに書き切ってからまとめて置き換える
+  journal = main.RestoreJournal(storage_dir)
+  journal.open()
+  completed = False
+  try:
+    for (reiwa, month), save_data in marged:
+      journal.stage("bench", reiwa, month, save_data)
+    journal.commit()
+    completed = True
+  finally:
+    journal.close(completed)
+
+def measureStartup(runs: int) -> Dict[str, Any]:
+  """main.pyの起動時間を別プロセスで計り、起動時に重いモジュールを読み込んでいないか確かめる"""
+  main_path = Path(main.__file__).resolve()
+  seconds: List[float] = []
+  for _ in range(runs):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, str(main_path), "--help"], check=True, stdout=subprocess.DEVNULL)
+    seconds.append(time.perf_counter() - start)
+  check = f"import sys; import main; print(','.join(m for m in {STARTUP_LAZY_MODULES!r} if m in sys.modules))"
+  loaded = subprocess.run([sys.executable, "-c", check], check=True, cwd=str(main_path.parent),
+                          capture_output=True, text=True).stdout.strip()
+  return {"seconds": statistics.median(seconds), "runs": runs, "budget_seconds": STARTUP_BUDGET_SECONDS,
+          "eager_modules": [module for module in loaded.split(",") if module != ""]}
+
+def printStartup(startup: Dict[str, Any]) -> bool:
+  ok = startup["seconds"] <= startup["budget_seconds"] and len(startup["eager_modules"]) == 0
+  print(f"startup (--help, median of {startup['runs']}): {startup['seconds'] * 1000:.1f} ms "
+        f"(budget {startup['budget_seconds'] * 1000:.0f} ms) {'OK' if ok else 'OVER BUDGET'}")
+  if len(startup["eager_modules"]) > 0:
+    print(f"  loaded at import: {', '.join(startup['eager_modules'])}")
+  return ok
+
+def printResults(results: List[Dict[str, Any]]):
+  print(f"{'stage':<26}{'items':>8}{'total [s]':>12}{'per item [ms]':>16}{'peak [MiB]':>12}")
+  for result in results:
+    per_item = result["seconds"] / max(result["items"], 1) * 1000
+    print(f"{result['stage']:<26}{result['items']:>8}{result['seconds']:>12.3f}{per_item:>16.3f}{result['peak_bytes'] / 1024 / 1024:>12.2f}")
+
+def parseArgs(argv: Optional[List[str]] = None) -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description="合成した日誌エクセルファイルで復元処理の各段階を計測します。")
+  parser.add_argument("--days", type=int, default=60, help="作成する日誌の日数")
+  parser.add_argument("--children", type=int, default=25, help="1枚あたりの園児の人数")
+  parser.add_argument("--text-length", type=int, default=40, help="視診・活動の流れ・連絡事項などの文章の長さ")
+  parser.add_argument("--engine", choices=main.XLSX_ENGINES, default=main.XLSX_ENGINE, help="エクセルファイルの読み込みエンジン")
+  parser.add_argument("--seed", type=int, default=0, help="乱数の種")
+  parser.add_argument("--startup-runs", type=int, default=5, help="起動時間を計る回数 (0なら計らない)")
+  parser.add_argument("--check-parity", action="store_true",
+                      help="計測はせずに、nativeとopenpyxlの読み込みエンジンが同じ結果になるかを確かめます")
+  parser.add_argument("--output", type=Path, default=None, help="計測結果をJSONで書き出すファイル")
+  return parser.parse_args(argv)
+
+def benchMain(argv: Optional[List[str]] = None):
+  args = parseArgs(argv)
+  if args.check_parity:
+    with tempfile.TemporaryDirectory() as tmp:
+      differences = checkParity(Path(tmp), args.children, args.text_length, args.seed)
+    for difference in differences:
+      print(difference)
+    print(f"parity: {len(PARITY_VARIANTS) - len({d.split(':')[0] for d in differences})}/{len(PARITY_VARIANTS)} variants match")
+    if len(differences) > 0:
+      sys.exit(1)
+    return
+  startup = measureStartup(args.startup_runs) if args.startup_runs > 0 else None
+  with tempfile.TemporaryDirectory() as tmp:
+    tmp_dir = Path(tmp)
+    xlsx_dir = tmp_dir.joinpath("xlsx")
+    storage_dir = tmp_dir.joinpath("storage")
+    xlsx_dir.mkdir()
+    storage_dir.mkdir()
+    print(f"日誌を{args.days}日分作成中 (園児{args.children}人, 文章{args.text_length}文字)", file=sys.stderr)
+    xlsx_paths = generateWorkload(xlsx_dir, args.days, args.children, args.text_length, args.seed)
+    results = runBenchmark(xlsx_paths, args.engine, storage_dir)
+  printResults(results)
+  startup_ok = printStartup(startup) if startup is not None else True
+  if args.output is not None:
+    report = {"days": args.days, "children": args.children, "text_length": args.text_length,
+              "engine": args.engine, "stages": results, "startup": startup}
+    with open(args.output, "w", encoding="utf-8") as f:
+      json.dump(report, f, ensure_ascii=False, indent=2)
+  # 起動時間の上限を超えたら、CIなどで気づけるよう終了コードで知らせる
+  if not startup_ok:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  benchMain()
@@ -1,27 +1,97 @@
 # coding: utf-8
 
 try:
-  from openpyxl.workbook.workbook import Workbook
-  from openpyxl.worksheet.worksheet import Worksheet
-  import openpyxl
   from pathlib import Path
   import json
-  from typing import List, Optional, Any, Dict, Tuple, Union
+  from typing import List, Optional, Any, Dict, Tuple, Union, Iterator, Iterable, Deque, TextIO, BinaryIO, Callable, NamedTuple, TYPE_CHECKING
   import re
   import sys
   import os
+  import argparse
+  import zipfile
+  import io
+  import posixpath
+  import hashlib
+  import tempfile
+  import stat
+  from xml.etree import ElementTree
+  from functools import partial
   from calendar import monthrange
+  import itertools
+  from array import array
+  import operator
+  import time
+  from datetime import datetime
+  from contextlib import contextmanager
+  from collections import deque
 
 except (ImportError, ModuleNotFoundError):
   print("モジュールが読み込めません。フォルダの置き場所を間違えている可能性があります。")
   exit()
+
+# openpyxlは読み込みに時間がかかるので、型注釈のためには読み込まない (実際に使うときはloadOpenpyxl)
+# 並列処理・SQLite・CSV・計測用のモジュールも、既定の実行やヘルプでは使わないので使う関数の中で読み込む
+if TYPE_CHECKING:
+  from openpyxl.workbook.workbook import Workbook
+  from openpyxl.worksheet.worksheet import Worksheet
+  from concurrent.futures import ProcessPoolExecutor, Future
   
 DIR_PATH = Path("エクセルリスト").resolve()
 KLASS_NAME_FILE_PATH = Path("クラス名.txt").resolve()
+# 複数クラスをまとめて復元するときの、エクセルリスト内のフォルダ名とクラス名の対応表
+KLASS_MANIFEST_FILE_PATH = Path("クラス一覧.txt").resolve()
 STORAGE_DIR_PATH = Path("..\\ストレージ").resolve()
 
+# 並列解析のプロセス数 (1なら逐次処理、0ならCPUコア数)
+PARSE_WORKERS = 1
+# プロセスプールに先に投入しておく、1プロセスあたりのファイル数 (入力を全部読み切らずに解析を始められる)
+PARSE_WINDOW_PER_WORKER = 16
+# プロセスプールに1回で渡すファイル数 (受け渡しの回数を減らす)
+PARSE_CHUNK_SIZE = 4
+# エクセルファイルの読み込みエンジン ("native"で読み込めないファイルはopenpyxlで読み直す)
+XLSX_ENGINES = ("native", "openpyxl")
+XLSX_ENGINE = "native"
+# エクセルリストのzipファイルの中のエクセルファイルも、展開せずに直接読み込む
+# (ファイル名にUTF-8の印がないzipは、Windowsで作られたものとしてcp932で読む)
+ZIP_METADATA_ENCODING = "cp932"
+# zipファイルの中のエクセルファイルを表す文字列での、zipファイルのパスと中のパスの区切り
+ARCHIVE_MEMBER_SEPARATOR = "::"
+# 解析結果のキャッシュ (内容が変わっていないエクセルファイルは解析を省略する)
+CACHE_DIR_PATH = Path("キャッシュ").resolve()
+PARSE_CACHE_ENABLED = True
+PARSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+PARSE_CACHE_FORMAT = 1
+# ストレージの月のファイルを並行して読み込むスレッド数
+STORAGE_IO_WORKERS = 8
+# 月ごとに解析・保存を進める (数年分をまとめて復元するときのメモリ使用量を抑える)
+STREAM_RESTORE = False
+# 月のデータを改行・インデントなしで保存する
+COMPACT_JSON = False
+# ストレージにすでにデータがある日の扱い
+#   error: エラーにする / keep: 保存済みのデータを残す / overwrite: エクセルファイルの内容で上書きする
+#   identical: 内容がまったく同じならそのまま (何もしない)、異なればエラーにする
+MERGE_POLICIES = ("error", "keep", "overwrite", "identical")
+MERGE_POLICY = "identical"
+# 解析を始める前に、全ファイルの日付だけを読んで重複・衝突を確認する
+PRESCAN_ENABLED = True
+# 監視モードでエクセルリストを確認する間隔と、コピー中とみなさなくなるまでファイルが変化しない時間 [秒]
+WATCH_INTERVAL_SECONDS = 2.0
+WATCH_SETTLE_SECONDS = 3.0
+# ストレージの内容を検索用に写しておくSQLiteのデータベース (--mirrorを付けたときだけ更新する)
+MIRROR_DB_PATH = Path("ミラー.sqlite3").resolve()
+MIRROR_ENABLED = False
+# ストレージから日誌エクセルファイルを書き出すフォルダ
+EXPORT_DIR_PATH = Path("書き出し").resolve()
+# 出欠・健康の集計を書き出すフォルダ
+STATS_DIR_PATH = Path("集計").resolve()
+STATS_FORMATS = ("xlsx", "csv")
+# 月のファイルの書き込みを記録するジャーナル (ストレージフォルダに置き、復元が終われば削除する)
+JOURNAL_FILE_NAME = "fukugen_journal.jsonl"
+
 class AppError(Exception):
   def __init__(self, message: str):
+    # 並列解析時にプロセス間で受け渡せるよう、messageを引数として基底クラスにも渡す
+    super().__init__(message)
     self.message = message
 
 def debugPrint(explain, *args, **kwargs):
@@ -34,7 +104,88 @@ def debugPrint(explain, *args, **kwargs):
 
 def abortProgram():
   print("エラーが発生したため、プログラムを中断します。", file=sys.stderr)
-  exit()
+  # バッチファイルやスクリプトから失敗を判定できるよう、終了コードを1にする
+  sys.exit(1)
+
+class StageTimer:
+  """段階ごとの処理時間を積算する (解析を行うプロセスごとに1つ)"""
+  def __init__(self) -> None:
+    self.seconds: Dict[str, float] = {}
+
+  @contextmanager
+  def measure(self, name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.seconds[name] = self.seconds.get(name, 0.0) + (time.perf_counter() - start)
+
+  def reset(self) -> Dict[str, float]:
+    seconds = self.seconds
+    self.seconds = {}
+    return seconds
+
+STAGE_TIMER = StageTimer()
+
+class RunReport:
+  """ファイルごと・段階ごとの処理時間と警告を、1行1レコードのJSONLで書き出す実行レポート"""
+  def __init__(self, report_path: Path, trace_memory: bool = False) -> None:
+    self.report_path = report_path
+    self.trace_memory = trace_memory
+    self.started = time.perf_counter()
+    self.totals: Dict[str, float] = {}
+    self.n_files = 0
+    self.n_cached = 0
+    self.n_openpyxl = 0
+    self.n_warnings = 0
+    self.f: TextIO = open(report_path, "w", encoding="utf-8")
+    self.write({"type": "run", "started_at": datetime.now().isoformat(timespec="seconds"), "argv": sys.argv[1:]})
+
+  def write(self, record: Dict[str, Any]):
+    self.f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+  def addTime(self, stage: str, seconds: float):
+    self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+
+  def recordFile(self, xlsx_path: "Union[Path, ArchiveMember]", dt: "ReiwaDate", warnings: List[str], stats: Dict[str, Any]):
+    self.n_files += 1
+    self.n_warnings += len(warnings)
+    if stats.get("cached", False):
+      self.n_cached += 1
+    if stats.get("engine") == "openpyxl":
+      self.n_openpyxl += 1
+    for stage, value in stats.items():
+      if isinstance(value, float):
+        self.addTime(stage, value)
+    self.write({"type": "file", "file": str(xlsx_path), "date": [dt.reiwa, dt.month, dt.day],
+                "stats": stats, "warnings": warnings})
+
+  @staticmethod
+  @contextmanager
+  def measure(report: Optional["RunReport"], stage: str, target: str) -> Iterator[None]:
+    # reportがNoneのときは何も計測しない
+    if report is None:
+      yield
+      return
+    if report.trace_memory:
+      import tracemalloc
+      tracemalloc.start()
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      seconds = time.perf_counter() - start
+      record: Dict[str, Any] = {"type": "stage", "stage": stage, "target": target, "seconds": seconds}
+      if report.trace_memory:
+        record["alloc_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+      report.addTime(stage, seconds)
+      report.write(record)
+
+  def close(self):
+    self.write({"type": "summary", "wall_seconds": time.perf_counter() - self.started, "files": self.n_files,
+                "cached_files": self.n_cached, "openpyxl_files": self.n_openpyxl, "warnings": self.n_warnings, "stage_seconds": self.totals})
+    self.f.close()
 
 def getNumberOfDays(reiwa_nendo: int, month: int) -> int:
   __AD_REIWA_GANNNENN = 2019
@@ -42,10 +193,13 @@ def getNumberOfDays(reiwa_nendo: int, month: int) -> int:
   ad_nen = (__AD_REIWA_GANNNENN - 1) + reiwa_nen
   return monthrange(ad_nen, month)[1]
 
-def checkPathsExistence():
+def checkPathsExistence(multi_klass: bool = False):
   if not DIR_PATH.exists():
     raise AppError("エクセルリストフォルダが存在しません。")
-  if not KLASS_NAME_FILE_PATH.exists():
+  if multi_klass:
+    if not KLASS_MANIFEST_FILE_PATH.exists():
+      raise AppError("クラス一覧.txtが存在しません。")
+  elif not KLASS_NAME_FILE_PATH.exists():
     raise AppError("クラス名.txtが存在しません。")
   if not STORAGE_DIR_PATH.exists():
     raise AppError("ストレージフォルダが存在しません。")
@@ -61,6 +215,25 @@ def loadKlassName(klass_name_file_path: Path) -> str:
     raise AppError("クラス名.txtにはクラス名を記述してください。")
   return klass
 
+def writeFileAtomic(file_path: Path, text: str):
+  # 同じフォルダの一時ファイルに書き切ってから置き換えるので、途中で止まっても元のファイルは壊れない
+  fd, tmp_path = tempfile.mkstemp(dir=str(file_path.parent), prefix=f".{file_path.name}.", suffix=".tmp")
+  try:
+    if file_path.exists():
+      os.chmod(tmp_path, stat.S_IMODE(os.stat(file_path).st_mode))
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+      f.write(text)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(tmp_path, str(file_path))
+  except BaseException:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+    raise
+
+def monthlySavePath(storage_path: Path, reiwa: int, klass: str, month: int) -> Path:
+  return storage_path.joinpath(str(reiwa), klass, f"{month}.json")
+
 def readMonthlySave(storage_path: Path, reiwa: int, klass: str, month: int) -> List:
   reiwa_dir_path = storage_path.joinpath(str(reiwa)).resolve()
   if not reiwa_dir_path.exists():
@@ -68,14 +241,508 @@ def readMonthlySave(storage_path: Path, reiwa: int, klass: str, month: int) -> L
   klass_dir_path = reiwa_dir_path.joinpath(klass).resolve()
   if not klass_dir_path.exists():
     raise AppError(f"エラー: {reiwa}年{klass}組のフォルダが存在しません。")
-  month_file_path = klass_dir_path.joinpath(str(month)).resolve()
+  month_file_path = monthlySavePath(storage_path, reiwa, klass, month)
   if not month_file_path.exists():
     raise AppError(f"エラー: {reiwa}年{klass}組{month}月のjsonファイルが存在しません。")
-  
-  with open(month_file_path, "r", encoding="utf-8") as f:
+  save_data = loadExistingMonthlySave(storage_path, reiwa, klass, month)
+  if save_data is None:
+    raise AppError(f"エラー: {reiwa}年{klass}組{month}月のjsonファイルにデータがありません。")
+  return save_data
+
+def loadExistingMonthlySave(storage_path: Path, reiwa: int, klass: str, month: int) -> Optional[List[Optional[List[Any]]]]:
+  # まだ保存されていない月 (ファイルが無い、または空) はNoneを返す
+  month_file_path = monthlySavePath(storage_path, reiwa, klass, month)
+  if not month_file_path.exists() or os.path.getsize(month_file_path) == 0:
+    return None
+  with open(str(month_file_path), "r", encoding="utf-8") as f:
     return json.load(f)
 
+def iterMonthlySaves(storage_path: Path, klass: str, reiwa_months: List[Tuple[int, int]],
+                     workers: int = STORAGE_IO_WORKERS,
+                     window: Optional[int] = None) -> Iterator[Tuple[Tuple[int, int], Optional[List[Optional[List[Any]]]]]]:
+  """複数の月のファイルをスレッドで並行して読み、reiwa_monthsの順に返す (読み込み待ちの間に呼び出し側の処理が進む)
+  windowを指定すると、先読みする月の数をその数までに抑える"""
+  if workers <= 1 or len(reiwa_months) <= 1:
+    for reiwa, month in reiwa_months:
+      yield (reiwa, month), loadExistingMonthlySave(storage_path, reiwa, klass, month)
+    return
+  window = len(reiwa_months) if window is None else max(window, 1)
+  from concurrent.futures import ThreadPoolExecutor
+  with ThreadPoolExecutor(max_workers=min(workers, len(reiwa_months))) as executor:
+    pending: Deque[Tuple[Tuple[int, int], "Future"]] = deque()
+    remaining = iter(reiwa_months)
+    try:
+      for reiwa, month in itertools.islice(remaining, window):
+        pending.append(((reiwa, month), executor.submit(loadExistingMonthlySave, storage_path, reiwa, klass, month)))
+      while len(pending) > 0:
+        reiwa_month, future = pending.popleft()
+        for reiwa, month in itertools.islice(remaining, 1):
+          pending.append(((reiwa, month), executor.submit(loadExistingMonthlySave, storage_path, reiwa, klass, month)))
+        yield reiwa_month, future.result()
+    finally:
+      for _, future in pending:
+        future.cancel()
+
+def prefetchMonthlySaves(storage_path: Path, klass: str, reiwa_months: List[Tuple[int, int]],
+                         workers: int = STORAGE_IO_WORKERS) -> Dict[Tuple[int, int], Optional[List[Optional[List[Any]]]]]:
+  return dict(iterMonthlySaves(storage_path, klass, reiwa_months, workers))
+
+def dumpMonthlySave(save_data: List[Optional[List[Any]]], compact: bool = False) -> str:
+  if compact:
+    # 改行・インデントを省いた形式 (日誌アプリでもそのまま読み込める)
+    return json.dumps(save_data, ensure_ascii=False, separators=(",", ":"))
+  return json.dumps(save_data, ensure_ascii=False, indent=5)
+
+def prepareMonthlySave(storage_path: Path, reiwa: int, klass: str, month: int) -> Path:
+  # 年度・クラスのフォルダが無ければ、日誌アプリと同じく12か月分の空のファイルと一緒に作る
+  if not storage_path.joinpath(str(reiwa)).exists():
+    storage_path.joinpath(str(reiwa)).mkdir()
+  if not storage_path.joinpath(str(reiwa), klass).exists():
+    storage_path.joinpath(str(reiwa), klass).mkdir()
+    for i in range(1, 13):
+      storage_path.joinpath(str(reiwa), klass, f"{i}.json").touch()
+  file_path = monthlySavePath(storage_path, reiwa, klass, month)
+  if not file_path.exists():
+    raise FileNotFoundError(f"令和{reiwa}年{month}月のデータが存在しません。")
+  return file_path
+
+MIRROR_SCHEMA = """
+CREATE TABLE IF NOT EXISTS months (
+  klass TEXT NOT NULL, reiwa INTEGER NOT NULL, month INTEGER NOT NULL,
+  size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,
+  PRIMARY KEY (klass, reiwa, month)
+);
+CREATE TABLE IF NOT EXISTS days (
+  klass TEXT NOT NULL, reiwa INTEGER NOT NULL, month INTEGER NOT NULL, day INTEGER NOT NULL,
+  weather TEXT, temperature INTEGER, humidity INTEGER,
+  n_belongs INTEGER, n_attends INTEGER, n_absents INTEGER, recorder TEXT,
+  inspections TEXT, activities TEXT, day_flows TEXT, home_contacts TEXT, near_misses TEXT,
+  PRIMARY KEY (klass, reiwa, month, day)
+);
+CREATE TABLE IF NOT EXISTS profiles (
+  klass TEXT NOT NULL, reiwa INTEGER NOT NULL, month INTEGER NOT NULL, day INTEGER NOT NULL, position INTEGER NOT NULL,
+  name TEXT NOT NULL, attendance INTEGER, abs_reason TEXT, medicine INTEGER,
+  excretion INTEGER, eating INTEGER, sleeping INTEGER, overview TEXT,
+  PRIMARY KEY (klass, reiwa, month, day, position)
+);
+CREATE INDEX IF NOT EXISTS days_date ON days (reiwa, month, day);
+CREATE INDEX IF NOT EXISTS days_recorder ON days (recorder);
+CREATE INDEX IF NOT EXISTS profiles_date ON profiles (reiwa, month, day);
+CREATE INDEX IF NOT EXISTS profiles_name ON profiles (name, reiwa, month, day);
+CREATE INDEX IF NOT EXISTS profiles_abs_reason ON profiles (abs_reason);
+"""
+
+class StorageMirror:
+  """ストレージの月のファイルをSQLiteに写したもの。月のファイルの(サイズ, 更新時刻)が変わった月だけ写し直す"""
+  def __init__(self, db_path: Path) -> None:
+    import sqlite3
+    self.connection = sqlite3.connect(str(db_path))
+    self.connection.executescript(MIRROR_SCHEMA)
+
+  def close(self):
+    self.connection.close()
+
+  def syncMonth(self, storage_path: Path, klass: str, reiwa: int, month: int) -> bool:
+    """月のファイルが前回写したときから変わっていれば写し直してTrueを返す"""
+    month_file_path = monthlySavePath(storage_path, reiwa, klass, month)
+    try:
+      file_stat = month_file_path.stat()
+    except FileNotFoundError:
+      file_stat = None
+    key = (klass, reiwa, month)
+    known = self.connection.execute("SELECT size, mtime_ns FROM months WHERE klass = ? AND reiwa = ? AND month = ?", key).fetchone()
+    stamp = (file_stat.st_size, file_stat.st_mtime_ns) if file_stat is not None else None
+    if known == stamp:
+      return False
+    save_data = loadExistingMonthlySave(storage_path, reiwa, klass, month) if file_stat is not None else None
+    with self.connection:
+      self.connection.execute("DELETE FROM days WHERE klass = ? AND reiwa = ? AND month = ?", key)
+      self.connection.execute("DELETE FROM profiles WHERE klass = ? AND reiwa = ? AND month = ?", key)
+      self.connection.execute("DELETE FROM months WHERE klass = ? AND reiwa = ? AND month = ?", key)
+      if stamp is None:
+        return True
+      self.connection.execute("INSERT INTO months VALUES (?, ?, ?, ?, ?)", key + stamp)
+      day_rows: List[Tuple[Any, ...]] = []
+      profile_rows: List[Tuple[Any, ...]] = []
+      for day, day_data in enumerate(save_data or [], 1):
+        if day_data is None:
+          continue
+        # listenPageのダンプの並び: 天気, 気温, 湿度, [在籍, 出席, 欠席], 記録者, 視診, 活動, 活動の流れ, 家庭連絡, ヒヤリハット, プロフィール
+        weather, temperature, humidity, counts, recorder, inspections, activities, day_flows, home_contacts, near_misses, profile_dumps = day_data
+        day_rows.append(key + (day, weather, temperature, humidity, counts[0], counts[1], counts[2], recorder,
+                               json.dumps(inspections, ensure_ascii=False), json.dumps(activities, ensure_ascii=False),
+                               json.dumps(day_flows, ensure_ascii=False), json.dumps(home_contacts, ensure_ascii=False),
+                               json.dumps(near_misses, ensure_ascii=False)))
+        for position, profile_dump in enumerate(profile_dumps):
+          profile_rows.append(key + (day, position) + tuple(profile_dump))
+      self.connection.executemany(f"INSERT INTO days VALUES ({', '.join(['?'] * 16)})", day_rows)
+      self.connection.executemany(f"INSERT INTO profiles VALUES ({', '.join(['?'] * 13)})", profile_rows)
+    return True
+
+  def sync(self, storage_path: Path) -> int:
+    """ストレージ全体を確かめ、変わった月だけを写し直す。写し直した月の数を返す"""
+    found = set()
+    for reiwa_dir in storage_path.iterdir():
+      if not reiwa_dir.is_dir() or not reiwa_dir.name.isdigit():
+        continue
+      for klass_dir in reiwa_dir.iterdir():
+        if not klass_dir.is_dir():
+          continue
+        for month in range(1, 13):
+          if klass_dir.joinpath(f"{month}.json").exists():
+            found.add((klass_dir.name, int(reiwa_dir.name), month))
+    known = set(self.connection.execute("SELECT klass, reiwa, month FROM months").fetchall())
+    n_synced = 0
+    for klass, reiwa, month in sorted(found | known):
+      if self.syncMonth(storage_path, klass, reiwa, month):
+        n_synced += 1
+    return n_synced
+
+  def findAbsences(self, name: str, reason: Optional[str] = None, reiwa: Optional[int] = None) -> List[Tuple[str, int, int, int, Optional[str]]]:
+    """園児が欠席した日を(クラス, 令和年度, 月, 日, 欠席理由)のリストで返す"""
+    query = "SELECT klass, reiwa, month, day, abs_reason FROM profiles WHERE name = ? AND attendance = 0"
+    params: List[Any] = [name]
+    if reason is not None:
+      query += " AND abs_reason = ?"
+      params.append(reason)
+    if reiwa is not None:
+      query += " AND reiwa = ?"
+      params.append(reiwa)
+    return self.connection.execute(query + " ORDER BY reiwa, month, day", params).fetchall()
+
+# 年度の月の並び
+NENDO_MONTHS = (4, 5, 6, 7, 8, 9, 10, 11, 12, 1, 2, 3)
+# 集計する選択肢の項目 (profilesの列名, 表示名)。先頭の出欠は出席率に、それ以外はコードの平均に使う
+STATS_METRICS = (("attendance", "出欠"), ("excretion", "排泄"), ("eating", "食事"), ("sleeping", "睡眠"))
+
+def loadOpenpyxl() -> Any:
+  # nativeエンジンで読めないファイルやエクセルファイルの書き出しで初めて読み込むので、
+  # パスの確認・ヘルプ・キャッシュだけで済む試し実行などでは起動が速くなる
+  try:
+    import openpyxl
+  except ImportError:
+    raise AppError("モジュールが読み込めません。フォルダの置き場所を間違えている可能性があります。")
+  return openpyxl
+
+def loadNumpy() -> Any:
+  # NumPyは集計を速くするためだけに使うので、入っていなければPythonだけで計算する
+  try:
+    import numpy
+  except ImportError:
+    return None
+  return numpy
+
+class KlassYearCodes:
+  """クラスの1年度分の選択肢のコードを、(日, 園児, 項目)の順に並べた1本の配列で持つ
+  未選択の日や、その日の名簿にいない園児はMISSING_CODEになる"""
+  def __init__(self, klass: str, reiwa: int, names: List[str], days: List[Tuple[int, int]], codes: array,
+               absence_reasons: Dict[str, Dict[str, int]]) -> None:
+    self.klass = klass
+    self.reiwa = reiwa
+    self.names = names
+    self.days = days
+    self.codes = codes
+    self.absence_reasons = absence_reasons
+
+  @staticmethod
+  def load(mirror: StorageMirror, klass: str, reiwa: int) -> "KlassYearCodes":
+    columns = ", ".join(column for column, _ in STATS_METRICS)
+    rows = mirror.connection.execute(
+      f"SELECT month, day, name, abs_reason, {columns} FROM profiles WHERE klass = ? AND reiwa = ? "
+      "ORDER BY (month + 8) % 12, day, position", (klass, reiwa)).fetchall()
+    # 園児は年度の中で最初に出てきた順に並べる
+    names = list(dict.fromkeys(row[2] for row in rows))
+    days = list(dict.fromkeys((row[0], row[1]) for row in rows))
+    child_index = {name: i for i, name in enumerate(names)}
+    day_index = {day: i for i, day in enumerate(days)}
+    n_metrics = len(STATS_METRICS)
+    codes = array("b", [MISSING_CODE]) * (len(days) * len(names) * n_metrics)
+    absence_reasons: Dict[str, Dict[str, int]] = {}
+    for month, day, name, abs_reason, *values in rows:
+      offset = (day_index[(month, day)] * len(names) + child_index[name]) * n_metrics
+      for k, value in enumerate(values):
+        if value is not None:
+          codes[offset + k] = value
+      if values[0] == 0:
+        reasons = absence_reasons.setdefault(name, {})
+        reason = abs_reason if abs_reason is not None else "(未選択)"
+        reasons[reason] = reasons.get(reason, 0) + 1
+    return KlassYearCodes(klass, reiwa, names, days, codes, absence_reasons)
+
+def aggregateKlassYear(year: KlassYearCodes) -> Dict[str, List[List[Any]]]:
+  """月ごとと年間の出席・欠席の日数と、項目ごとのコードの平均を求める
+  どの値も[園児][月]のリストで、月の添字はNENDO_MONTHSの順、最後 (12) が年間"""
+  n_days = len(year.days)
+  n_children = len(year.names)
+  n_metrics = len(STATS_METRICS)
+  n_slots = len(NENDO_MONTHS) + 1
+  slots = [NENDO_MONTHS.index(month) for month, _ in year.days]
+  aggregates: Dict[str, List[List[Any]]] = {}
+  np = loadNumpy()
+  if np is not None:
+    # (日, 園児, 項目)の配列を、日ごとの月の添字でまとめて足し込む
+    codes = np.frombuffer(year.codes, dtype=np.int8).reshape(n_days, n_children, n_metrics)
+    slot_index = np.array(slots, dtype=np.intp)
+    valid = codes >= 0
+    sums = np.zeros((n_slots, n_children, n_metrics), dtype=np.int64)
+    counts = np.zeros((n_slots, n_children, n_metrics), dtype=np.int64)
+    np.add.at(sums, slot_index, np.where(valid, codes, 0))
+    np.add.at(counts, slot_index, valid)
+    attend = np.zeros((n_slots, n_children), dtype=np.int64)
+    absent = np.zeros((n_slots, n_children), dtype=np.int64)
+    np.add.at(attend, slot_index, codes[:, :, 0] == 2)
+    np.add.at(absent, slot_index, codes[:, :, 0] == 0)
+    for table in (sums, counts, attend, absent):
+      table[-1] = table[:-1].sum(axis=0)
+    aggregates["attend"] = attend.T.tolist()
+    aggregates["absent"] = absent.T.tolist()
+    for k, (column, _) in enumerate(STATS_METRICS[1:], 1):
+      with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums[:, :, k] / counts[:, :, k]
+      aggregates[column] = [[None if count == 0 else float(mean) for mean, count in zip(child_means, child_counts)]
+                            for child_means, child_counts in zip(means.T.tolist(), counts[:, :, k].T.tolist())]
+    return aggregates
+  attend_rows = [[0] * n_slots for _ in range(n_children)]
+  absent_rows = [[0] * n_slots for _ in range(n_children)]
+  sum_rows = [[[0] * n_slots for _ in range(n_children)] for _ in range(n_metrics)]
+  count_rows = [[[0] * n_slots for _ in range(n_children)] for _ in range(n_metrics)]
+  for d, slot in enumerate(slots):
+    for c in range(n_children):
+      offset = (d * n_children + c) * n_metrics
+      for k in range(n_metrics):
+        code = year.codes[offset + k]
+        if code < 0:
+          continue
+        for target in (slot, n_slots - 1):
+          sum_rows[k][c][target] += code
+          count_rows[k][c][target] += 1
+          if k == 0 and code == 2:
+            attend_rows[c][target] += 1
+          elif k == 0 and code == 0:
+            absent_rows[c][target] += 1
+  aggregates["attend"] = attend_rows
+  aggregates["absent"] = absent_rows
+  for k, (column, _) in enumerate(STATS_METRICS[1:], 1):
+    aggregates[column] = [[None if count == 0 else total / count for total, count in zip(child_sums, child_counts)]
+                          for child_sums, child_counts in zip(sum_rows[k], count_rows[k])]
+  return aggregates
+
+def statsTables(year: KlassYearCodes, aggregates: Dict[str, List[List[Any]]]) -> Dict[str, List[List[Any]]]:
+  """書き出す表 (シート名 -> 見出しを含む行のリスト) を作る"""
+  slot_labels = [f"{month}月" for month in NENDO_MONTHS] + ["年間"]
+  tables: Dict[str, List[List[Any]]] = {}
+  attendance_rows: List[List[Any]] = [["名前", "月", "出席", "欠席", "出席率"]]
+  for c, name in enumerate(year.names):
+    for slot, label in enumerate(slot_labels):
+      attend = aggregates["attend"][c][slot]
+      absent = aggregates["absent"][c][slot]
+      if attend + absent == 0 and slot < len(NENDO_MONTHS):
+        continue
+      rate = round(attend / (attend + absent), 3) if attend + absent > 0 else None
+      attendance_rows.append([name, label, attend, absent, rate])
+  tables["出欠"] = attendance_rows
+  reasons = sorted({reason for child_reasons in year.absence_reasons.values() for reason in child_reasons})
+  reason_rows: List[List[Any]] = [["名前"] + reasons]
+  for name in year.names:
+    child_reasons = year.absence_reasons.get(name, {})
+    reason_rows.append([name] + [child_reasons.get(reason, 0) for reason in reasons])
+  tables["欠席理由"] = reason_rows
+  for column, label in STATS_METRICS[1:]:
+    rows: List[List[Any]] = [["名前"] + slot_labels]
+    for c, name in enumerate(year.names):
+      rows.append([name] + [round(mean, 2) if mean is not None else None for mean in aggregates[column][c]])
+    tables[label] = rows
+  return tables
+
+def exportStatsTables(tables: Dict[str, List[List[Any]]], out_stem: Path, stats_format: str = "xlsx") -> List[Path]:
+  """表をxlsx (1ファイルに表ごとのシート) またはCSV (表ごとに1ファイル) で書き出す"""
+  if stats_format == "csv":
+    import csv
+    out_paths: List[Path] = []
+    for sheet_name, rows in tables.items():
+      out_path = out_stem.with_name(f"{out_stem.name}_{sheet_name}.csv")
+      # エクセルで開いても文字化けしないよう、BOM付きで書く
+      with open(out_path, "w", encoding="utf-8-sig", newline="") as f:
+        csv.writer(f).writerows(rows)
+      out_paths.append(out_path)
+    return out_paths
+  # 書き込み専用モードなら、行をそのまま流し込むだけなので大きな表でもメモリを使わない
+  wb = loadOpenpyxl().Workbook(write_only=True)
+  for sheet_name, rows in tables.items():
+    sheet = wb.create_sheet(sheet_name)
+    for row in rows:
+      sheet.append(row)
+  out_path = out_stem.with_suffix(".xlsx")
+  wb.save(str(out_path))
+  return [out_path]
+
+class RestoreJournal:
+  """ストレージフォルダに置く先行書き込みログ
+
+  書き込む月のデータはまず対象のファイルの隣の一時ファイル (staged) に書き切り、
+  すべての月を書き切ったらcommitを記録してから置き換える。途中で止まった場合は、
+  次の実行の最初にcommit済みなら置き換えを最後まで進め、そうでなければ一時ファイルを消して元に戻す。
+  置き換えが済んだ月はdoneとして記録し、--resumeでの再開時にはその月を飛ばす。
+  """
+  def __init__(self, storage_path: Path, mirror: Optional[StorageMirror] = None) -> None:
+    self.storage_path = storage_path
+    # 月のファイルを置き換えるたびに写し直すミラー
+    self.mirror = mirror
+    self.path = storage_path.joinpath(JOURNAL_FILE_NAME)
+    self.file: Optional[TextIO] = None
+    self.transaction = 0
+    self.staged: List[Dict[str, Any]] = []
+    # commitを記録したが、置き換えが終わっていない (stagedに残っている月は取り消してはいけない)
+    self.committed = False
+    # 前回までに保存が済んだ (クラス, 令和年度, 月)
+    self.done: set = set()
+
+  def exists(self) -> bool:
+    return self.path.exists()
+
+  def readRecords(self) -> List[Dict[str, Any]]:
+    records: List[Dict[str, Any]] = []
+    with open(self.path, "r", encoding="utf-8") as f:
+      for line in f:
+        try:
+          records.append(json.loads(line))
+        except ValueError:
+          # 書き込みの途中で止まった最後の行は無視する
+          break
+    return records
+
+  def recover(self):
+    """前回の中断された復元を、commit済みなら最後まで進め、そうでなければ元に戻す"""
+    if not self.exists():
+      return
+    records = self.readRecords()
+    committed = {record["transaction"] for record in records if record["type"] == "commit"}
+    replaced = {(record["transaction"], record["target"]) for record in records if record["type"] == "done"}
+    # 最後まで反映した月はdoneとして追記し、次に中断しても置き換え済みだとわかるようにする
+    done_records: List[Dict[str, Any]] = []
+    lost: List[Dict[str, Any]] = []
+    n_back = 0
+    for record in records:
+      if record["type"] == "done":
+        self.done.add((record["klass"], record["reiwa"], record["month"]))
+      if record["type"] != "staged" or (record["transaction"], record["target"]) in replaced:
+        continue
+      staged_path = Path(record["staged"])
+      if record["transaction"] in committed:
+        # 一時ファイルが無ければ置き換えられていないので、doneにはせず--resumeでもう一度保存させる
+        if not staged_path.exists():
+          lost.append(record)
+          continue
+        try:
+          os.replace(str(staged_path), record["target"])
+        except OSError as e:
+          raise AppError(f"エラー: {record['target']}を置き換えられません。日誌アプリを終了してから再実行してください。: {e}")
+        self.done.add((record["klass"], record["reiwa"], record["month"]))
+        done_records.append(dict(record, type="done"))
+      elif staged_path.exists():
+        staged_path.unlink()
+        n_back += 1
+    self.transaction = max([record.get("transaction", 0) for record in records] + [0])
+    if len(done_records) > 0:
+      with open(self.path, "a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in done_records))
+        f.flush()
+        os.fsync(f.fileno())
+    print("前回の復元は途中で中断されていました。")
+    if len(done_records) > 0:
+      print(f"確定済みだった{len(done_records)}か月分の書き込みを最後まで反映しました。")
+    if n_back > 0:
+      print(f"確定前だった{n_back}か月分の書き込みを取り消しました。")
+    for record in lost:
+      print(f"注意: 令和{record['reiwa']}年{record['month']}月 ({record['klass']}) の書き込みは一時ファイルが見つからず、反映できませんでした。"
+            f"この月のエクセルファイルをもう一度復元してください。")
+
+  def open(self, resume: bool = False):
+    # 再開しない場合は、前回の記録を捨てて新しく始める
+    if not resume:
+      self.done = set()
+    self.file = open(self.path, "a" if resume else "w", encoding="utf-8")
+    self.write({"type": "begin", "time": datetime.now().isoformat(timespec="seconds")}, sync=True)
+
+  def write(self, record: Dict[str, Any], sync: bool = False):
+    assert self.file is not None
+    self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    self.file.flush()
+    if sync:
+      os.fsync(self.file.fileno())
+
+  def isDone(self, klass: str, reiwa: int, month: int) -> bool:
+    return (klass, reiwa, month) in self.done
+
+  def stage(self, klass: str, reiwa: int, month: int, save_data: List[Optional[List[Any]]], compact: bool = False) -> bool:
+    """月のデータを一時ファイルに書き切る。保存済みの内容とまったく同じならFalseを返す"""
+    if len(self.staged) == 0:
+      self.transaction += 1
+    dumped = dumpMonthlySave(save_data, compact)
+    file_path = prepareMonthlySave(self.storage_path, reiwa, klass, month)
+    with open(str(file_path), "r", encoding="utf-8") as f:
+      if f.read() == dumped:
+        return False
+    staged_path = file_path.with_name(f".{file_path.name}.staged")
+    # 一時ファイルより先に記録しておけば、書き込みの途中で止まっても次のrecoverで必ず片付けられる
+    record = {"type": "staged", "transaction": self.transaction, "klass": klass, "reiwa": reiwa, "month": month,
+              "target": str(file_path), "staged": str(staged_path)}
+    self.write(record, sync=True)
+    self.staged.append(record)
+    with open(str(staged_path), "w", encoding="utf-8") as f:
+      f.write(dumped)
+      f.flush()
+      os.fsync(f.fileno())
+    if file_path.exists():
+      os.chmod(str(staged_path), stat.S_IMODE(os.stat(file_path).st_mode))
+    return True
+
+  def commit(self):
+    """一時ファイルに書いた月をまとめて確定し、対象のファイルと置き換える"""
+    if len(self.staged) > 0:
+      self.write({"type": "commit", "transaction": self.transaction}, sync=True)
+      self.committed = True
+      # 置き換えの途中で止まっても、残りの月はstagedに残しておき、closeで取り消さずにrecoverで反映する
+      while len(self.staged) > 0:
+        record = self.staged[0]
+        os.replace(record["staged"], record["target"])
+        self.staged.pop(0)
+        self.write(dict(record, type="done"))
+        self.done.add((record["klass"], record["reiwa"], record["month"]))
+        if self.mirror is not None:
+          self.mirror.syncMonth(self.storage_path, record["klass"], record["reiwa"], record["month"])
+    self.committed = False
+    self.staged = []
+
+  def rollback(self):
+    for record in self.staged:
+      if os.path.exists(record["staged"]):
+        os.remove(record["staged"])
+    self.staged = []
+
+  def close(self, completed: bool = True):
+    # 確定前の書き込みは取り消し、最後まで終わった (または何も保存しなかった) 復元の記録は残さない
+    # commit済みで置き換えが終わっていない書き込みは、一時ファイルと記録を残して次の実行のrecoverに任せる
+    if not self.committed:
+      self.rollback()
+    if self.file is not None:
+      self.file.close()
+      self.file = None
+    if not self.committed and (completed or len(self.done) == 0) and self.exists():
+      self.path.unlink()
+
+def dayOccupancy(save_data: Optional[List[Optional[List[Any]]]]) -> int:
+  # データのある日をビットで表す (1日目が最下位ビット)
+  bitmap = 0
+  if save_data is not None:
+    for i, day_data in enumerate(save_data):
+      if day_data is not None:
+        bitmap |= 1 << i
+  return bitmap
+
 class StructInspection:
+  __slots__ = ("name", "description")
+
   def __init__(self, name: str, description: str):
     self.name = name
     self.description = description
@@ -83,6 +750,13 @@ class StructInspection:
   def __repr__(self) -> str:
     return f"StructInspection({self.name}, {self.description})"
 
+# `名前: 説明`
+INSPECTION_PATTERN = re.compile(r"(.+): (.+)", re.DOTALL)
+# `[{hour}時{minute}分]{description}`
+DAY_FLOW_PATTERN = re.compile(r"\[(\d+)時(\d+)分\](.+)")
+TEMPERATURE_PATTERN = re.compile(r"(\d+)℃")
+HUMIDITY_PATTERN = re.compile(r"(\d+)％")
+
 def splitInspections(raw: str) -> Tuple[List[StructInspection], List[str]]:
   warnings: List[str] = []
   splitted = raw.split(", ")
@@ -90,8 +764,7 @@ def splitInspections(raw: str) -> Tuple[List[StructInspection], List[str]]:
   for i in range(len(splitted)):
     element = splitted[i]
     #group by pattern matching and check if the element is in the format of `name: description`, then split it.
-    pattern = r"(.+): (.+)"
-    match = re.match(pattern, element, re.DOTALL)
+    match = INSPECTION_PATTERN.match(element)
     if match is None:
       warnings.append(f"注意(視診を処理中): {element}は正しい形式ではありません。 `名前: 説明`の形式である必要があります。 処理をスキップします。")
       continue
@@ -106,6 +779,8 @@ def splitActivities(raw: str) -> List[str]:
   return splitted
 
 class StructDayFlow:
+  __slots__ = ("hour", "minute", "description")
+
   def __init__(self, hour: int, minute: int, description: str):
     self.hour = hour
     self.minute = minute
@@ -125,8 +800,7 @@ def splitDayFlows(raw: str) -> Tuple[List[StructDayFlow], List[str]]:
     element_str = splitted[i]
     element_str = element_str.lstrip()
     #group by pattern matching and check if the element is in the format of `[{hour}時{minute}分]{description}`, then extract hour, minute, description.
-    pattern = r"\[(\d+)時(\d+)分\](.+)"
-    match = re.match(pattern, element_str)
+    match = DAY_FLOW_PATTERN.match(element_str)
     if match is None:
       warnings.append(f"注意(活動の流れを処理中): {element_str}は正しい形式ではありません。 `[~時~分]<説明>`の形式である必要があります。 処理をスキップします。")
       continue
@@ -163,6 +837,8 @@ def splitNearMisses(raw: str) -> list:
   return splitted
 
 class StructChildDialyProfile:
+    __slots__ = ("name", "attendance", "abs_reason", "medicine", "excretion", "eating", "sleeping", "overview")
+
     def __init__(self, name: str, attendance: Optional[int], abs_reason: Optional[str],
                  medicine: Optional[int], excretion: Optional[int], eating: Optional[int],
                  sleeping: Optional[int], overview: Optional[str]) -> None:
@@ -179,6 +855,8 @@ class StructChildDialyProfile:
       return f"StructChildDialyProfile({self.name}, {self.attendance}, {self.abs_reason}, {self.medicine}, {self.excretion}, {self.eating}, {self.sleeping}, {self.overview})"
 
 class ReiwaDate:
+  __slots__ = ("reiwa", "month", "day")
+
   def __init__(self, reiwa: int, month: int, day: int) -> None:
     self.reiwa = reiwa
     self.month = month
@@ -194,6 +872,9 @@ class ReiwaDate:
       return False
 
 class StructDiaryPage:
+  __slots__ = ("dt", "weather", "temperature", "humidity", "recorder", "inspections", "activities",
+               "day_flows", "home_contacts", "near_misses", "profiles")
+
   def __init__(self, dt: ReiwaDate, weather: Optional[str], temperature: Optional[int],
                humidity: Optional[int], recorder: Optional[str], inspections: List[StructInspection], 
                activities: List[str], day_flows: List[StructDayFlow], home_contacts: List[str],
@@ -253,29 +934,25 @@ EATING_COL = NAME_COL + 6
 SLEEPING_COL = NAME_COL + 7
 OVERVIEW_COL = NAME_COL + 8
 
-def createDiaryFromXlsxSheet(sheet: Worksheet) -> Tuple[StructDiaryPage, List[str]]:
-  warnings: List[str] = []
-  raw_reiwa = sheet.cell(REIWA_POS[0], REIWA_POS[1]).internal_value
-  raw_reiwa = raw_reiwa if raw_reiwa is not None else ""
-  sreiwa: str = str(raw_reiwa)
+def _cellText(raw: Any) -> str:
+  return str(raw if raw is not None else "")
+
+def parseReiwaDateValues(raw_reiwa: Any, raw_month: Any, raw_day: Any) -> ReiwaDate:
+  sreiwa: str = _cellText(raw_reiwa)
   try:
     reiwa: int = int(sreiwa)
   except ValueError as e:
     raise AppError(f"エラー(令和年度を解析中): `{sreiwa}`は整数ではありません。")
   if not REIWA_NENDO_RANGE[0] <= reiwa <= REIWA_NENDO_RANGE[1]:
     raise AppError(f"エラー(令和年度を解析中): `{reiwa}`は{REIWA_NENDO_RANGE[0]}以上{REIWA_NENDO_RANGE[1]}以下の整数である必要があります。")
-  raw_month = sheet.cell(MONTH_POS[0], MONTH_POS[1]).value
-  raw_month = raw_month if raw_month is not None else ""
-  smonth = str(raw_month)
+  smonth = _cellText(raw_month)
   try:
     month: int = int(smonth)
   except ValueError:
     raise AppError(f"エラー(月を解析中): `{smonth}`は整数ではありません。")
   if not 1 <= month <= 12:
     raise AppError(f"エラー(月を解析中): `{month}`は1以上12以下の整数である必要があります。")
-  raw_day = sheet.cell(DAY_POS[0], DAY_POS[1]).value
-  raw_day = raw_day if raw_day is not None else ""
-  sday = str(raw_day)
+  sday = _cellText(raw_day)
   try:
     day: int = int(sday)
   except ValueError:
@@ -283,19 +960,22 @@ def createDiaryFromXlsxSheet(sheet: Worksheet) -> Tuple[StructDiaryPage, List[st
   max_day = getNumberOfDays(reiwa, month)
   if not 1 <= day <= max_day:
     raise AppError(f"エラー(日を解析中): `{day}`は1以上{max_day}以下の整数である必要があります。")
-  raw_weather = sheet.cell(WEATHER_POS[0], WEATHER_POS[1]).value
-  raw_weather = raw_weather if raw_weather is not None else ""
-  weather = str(raw_weather).strip()
+  return ReiwaDate(reiwa, month, day)
+
+# --- 各項目の値を解釈する関数 (生のセルの値と警告のリストを受け取る) ---
+
+def parseWeather(raw: Any, warnings: List[str]) -> Optional[str]:
+  weather = _cellText(raw).strip()
   if weather.isspace() or weather == "":
-    weather = None
-  elif weather not in VALID_WEATHERS:
+    return None
+  if weather not in VALID_WEATHERS:
     warnings.append(f"注意(天気を解析中): `{weather}`は有効な天気ではありません。未選択として処理します。")
-    weather = None
-  raw_temperature = sheet.cell(TEMPERATURE_POS[0], TEMPERATURE_POS[1]).value
-  raw_temperature = raw_temperature if raw_temperature is not None else ""
-  stemperature = str(raw_temperature).strip()
-  stemperature_pattern = r"(\d+)℃"
-  stemperature_match = re.match(stemperature_pattern, stemperature)
+    return None
+  return weather
+
+def parseTemperature(raw: Any, warnings: List[str]) -> int:
+  stemperature = _cellText(raw).strip()
+  stemperature_match = TEMPERATURE_PATTERN.match(stemperature)
   if stemperature_match is not None:
     temperature = int(stemperature_match.group(1))
   else:
@@ -304,11 +984,11 @@ def createDiaryFromXlsxSheet(sheet: Worksheet) -> Tuple[StructDiaryPage, List[st
   if not (0 <= temperature <= 39):
     warnings.append(f"注意(気温を解析中): `{temperature}`は有効な気温ではありません。0として処理します。")
     temperature = 0
-  raw_humidity = sheet.cell(HUMIDITY_POS[0], HUMIDITY_POS[1]).value
-  raw_humidity = raw_humidity if raw_humidity is not None else ""
-  shumidity = str(raw_humidity).strip()
-  shumidity_pattern = r"(\d+)％"
-  shumidity_match = re.match(shumidity_pattern, shumidity)
+  return temperature
+
+def parseHumidity(raw: Any, warnings: List[str]) -> int:
+  shumidity = _cellText(raw).strip()
+  shumidity_match = HUMIDITY_PATTERN.match(shumidity)
   if shumidity_match is not None:
     humidity = int(shumidity_match.group(1))
   else:
@@ -317,120 +997,638 @@ def createDiaryFromXlsxSheet(sheet: Worksheet) -> Tuple[StructDiaryPage, List[st
   if not (20 <= humidity <= 100):
     warnings.append(f"注意(湿度を解析中): `{humidity}`は有効な湿度ではありません。20として処理します。")
     humidity = 20
-  raw_recorder = sheet.cell(RECORDER_POS[0], RECORDER_POS[1]).value
-  raw_recorder = raw_recorder if raw_recorder is not None else ""
-  recorder = str(raw_recorder)
-  if recorder.isspace() or raw_recorder == "":
-    recorder = None
-  rawinspections = sheet.cell(INSPECTIONS_POS[0], INSPECTIONS_POS[1]).value
-  rawinspections = rawinspections if rawinspections is not None else ""
-  sinspections = str(rawinspections)
-  inspections = []
-  if sinspections != "" and not sinspections.isspace():
+  return humidity
+
+def parseRecorder(raw: Any, warnings: List[str]) -> Optional[str]:
+  recorder = _cellText(raw)
+  if recorder.isspace() or recorder == "":
+    return None
+  return recorder
+
+def parseInspections(raw: Any, warnings: List[str]) -> List[StructInspection]:
+  sinspections = _cellText(raw)
+  if sinspections == "" or sinspections.isspace():
+    return []
+  with STAGE_TIMER.measure("split"):
     inspections, inspections_warnings = splitInspections(sinspections)
-    if len(inspections_warnings) > 0:
-      warnings.append(f"視診を解析中に以下の警告がありました：\n" + "\n".join(inspections_warnings))
-  rawactivities = sheet.cell(ACTIVITIES_POS[0], ACTIVITIES_POS[1]).value
-  rawactivities = rawactivities if rawactivities is not None else ""
-  sactivities = str(rawactivities)
-  activities = []
-  if sactivities != "" and not sactivities.isspace():
-    activities = splitActivities(sactivities)
-  rawdayflows = sheet.cell(DAY_FLOWS_POS[0], DAY_FLOWS_POS[1]).value
-  rawdayflows = rawdayflows if rawdayflows is not None else ""
-  sdayflows = str(rawdayflows)
-  day_flows = []
-  if sdayflows != "" and not sdayflows.isspace():
+  if len(inspections_warnings) > 0:
+    warnings.append(f"視診を解析中に以下の警告がありました：\n" + "\n".join(inspections_warnings))
+  return inspections
+
+def parseDayFlows(raw: Any, warnings: List[str]) -> List[StructDayFlow]:
+  sdayflows = _cellText(raw)
+  if sdayflows == "" or sdayflows.isspace():
+    return []
+  with STAGE_TIMER.measure("split"):
     day_flows, day_flows_warnings = splitDayFlows(sdayflows)
-    if len(day_flows_warnings) > 0:
-      warnings.append(f"活動の流れを解析中に以下の警告がありました：\n" + "\n".join(day_flows_warnings))
-  rawhomecontacts = sheet.cell(HOME_CONTACTS_POS[0], HOME_CONTACTS_POS[1]).value
-  rawhomecontacts = rawhomecontacts if rawhomecontacts is not None else ""
-  shomecontacts = str(rawhomecontacts)
-  home_contacts = []
-  if shomecontacts != "" and not shomecontacts.isspace():
-    home_contacts = splitHomeContacts(shomecontacts)
-  rawnearmisses = sheet.cell(NEAR_MISSES_POS[0], NEAR_MISSES_POS[1]).value
-  rawnearmisses = rawnearmisses if rawnearmisses is not None else ""
-  snearmisses = str(rawnearmisses)
-  near_misses = []
-  if snearmisses is not None and snearmisses != "" and not snearmisses.isspace():
-    near_misses = splitNearMisses(snearmisses)
-  
-  profiles: Dict[str, StructChildDialyProfile] = {}
-  current_child_index = 0
-  while True:
-    raw_name = sheet.cell(PROFILES_POS[0] + current_child_index, NAME_COL).value
-    raw_name = raw_name if raw_name is not None else ""
-    name = str(raw_name)
-    if name is None or name.isspace() or name == "":
+  if len(day_flows_warnings) > 0:
+    warnings.append(f"活動の流れを解析中に以下の警告がありました：\n" + "\n".join(day_flows_warnings))
+  return day_flows
+
+def listParser(split: Callable[[str], List[str]]) -> Callable[[Any, List[str]], List[str]]:
+  # 警告を出さない`, `区切りの項目 (活動・家庭連絡・ヒヤリハット)
+  def parse(raw: Any, warnings: List[str]) -> List[str]:
+    text = _cellText(raw)
+    if text == "" or text.isspace():
+      return []
+    with STAGE_TIMER.measure("split"):
+      return split(text)
+  return parse
+
+def codeParser(table: Dict[str, Optional[int]], label: str, noun: str) -> Callable[[Any, List[str]], Optional[int]]:
+  # VALID_*の表で選択肢をコードに変換する項目 (出欠・くすり・排泄・食事・睡眠)
+  def parse(raw: Any, warnings: List[str]) -> Optional[int]:
+    text = _cellText(raw).strip()
+    if text not in table:
+      warnings.append(f"注意({label}を解析中): `{text}`は有効な{noun}ではありません。未選択として処理します。")
+      text = "---"
+    return table[text]
+  return parse
+
+def parseAbsenceReason(raw: Any, warnings: List[str]) -> Optional[str]:
+  abs_reason = _cellText(raw).strip()
+  if abs_reason == "":
+    return None
+  if abs_reason not in VALID_ABSENCE_REASONS:
+    warnings.append(f"注意(欠席理由を解析中): `{abs_reason}`は有効な欠席理由ではありません。未選択として処理します。")
+    return None
+  return abs_reason
+
+def parseOverview(raw: Any, warnings: List[str]) -> Optional[str]:
+  overview = _cellText(raw).strip()
+  if overview == "" or overview.isspace():
+    return None
+  return overview
+
+# --- 各項目の値をセルの値に戻す関数 (ストレージからエクセルファイルを書き出すときに使う) ---
+
+def encodeText(value: Any) -> Any:
+  return value
+
+def encodeTemperature(value: int) -> str:
+  return f"{value}℃"
+
+def encodeHumidity(value: int) -> str:
+  return f"{value}％"
+
+def encodeInspections(value: List[List[str]]) -> Optional[str]:
+  return ", ".join(f"{name}: {description}" for name, description in value) if len(value) > 0 else None
+
+def encodeDayFlows(value: List[List[Any]]) -> Optional[str]:
+  return ", ".join(f"[{hour}時{minute}分]{description}" for hour, minute, description in value) if len(value) > 0 else None
+
+def encodeList(value: List[str]) -> Optional[str]:
+  return ", ".join(value) if len(value) > 0 else None
+
+def codeEncoder(table: Dict[str, Optional[int]]) -> Callable[[Optional[int]], str]:
+  # コードを選択肢に戻す。未選択は`---`にする (空欄だと解析時に警告になる)
+  labels = {code: label for label, code in table.items()}
+  def encode(value: Optional[int]) -> str:
+    return labels.get(value, "---")
+  return encode
+
+# listenPageのダンプの並びと、SheetLayoutの項目名の対応
+DUMP_HEADER_FIELDS = ("weather", "temperature", "humidity", "counts", "recorder", "inspections", "activities",
+                      "day_flows", "home_contacts", "near_misses", "profiles")
+DUMP_PROFILE_FIELDS = ("name", "attendance", "abs_reason", "medicine", "excretion", "eating", "sleeping", "overview")
+
+# 選択肢の列で覚えておく、異なるセルの値の数の上限
+FIELD_LOOKUP_MAX_ENTRIES = 1024
+
+class FieldSpec:
+  """日誌テンプレートの1項目: 項目名、セル位置(ヘッダーは(行, 列)、園児の行は列)、値を解釈する関数
+
+  lookupがTrueの項目 (選択肢の列) は、解釈した結果をセルの値ごとに覚えておき、列をまとめて引き当てる
+  encodeは解釈した値をセルの値に戻す関数 (エクセルファイルの書き出しに使う)
+  """
+  __slots__ = ("name", "pos", "parse", "lookup", "encode")
+
+  def __init__(self, name: str, pos: Any, parse: Callable[[Any, List[str]], Any], lookup: bool = False,
+               encode: Callable[[Any], Any] = encodeText) -> None:
+    self.name = name
+    self.pos = pos
+    self.parse = parse
+    self.encode = encode
+    # 文字列と空欄のセルだけを覚える (Trueと1のように等しくても文字列にすると異なる値があるため)
+    self.lookup: Optional[Dict[Optional[str], Tuple[Any, List[str]]]] = {} if lookup else None
+
+  def decodeColumn(self, values: Dict[Tuple[int, int], Any], rows: List[int]) -> Tuple[List[Any], Optional[List[List[str]]]]:
+    """園児の一覧のこの列をまとめて解釈し、行ごとの値と警告を返す (警告がひとつもなければ警告はNone)"""
+    raws = list(map(values.get, zip(rows, itertools.repeat(self.pos))))
+    if self.lookup is None:
+      column: List[Any] = []
+      column_warnings: List[List[str]] = []
+      for raw in raws:
+        cell_warnings: List[str] = []
+        column.append(self.parse(raw, cell_warnings))
+        column_warnings.append(cell_warnings)
+      return column, column_warnings if any(column_warnings) else None
+    hits: List[Any] = list(map(self.lookup.get, raws))
+    if None in hits:
+      if len(self.lookup) > FIELD_LOOKUP_MAX_ENTRIES:
+        self.lookup.clear()
+      for index, raw in enumerate(raws):
+        if hits[index] is None:
+          cell_warnings = []
+          hits[index] = (self.parse(raw, cell_warnings), cell_warnings)
+          if raw is None or raw.__class__ is str:
+            self.lookup[raw] = hits[index]
+    column = [hit[0] for hit in hits]
+    if not any(map(operator.itemgetter(1), hits)):
+      return column, None
+    return column, [hit[1] for hit in hits]
+
+class SheetLayout:
+  """日誌テンプレートの版ごとのセル配置。読み取る範囲は作成時に一度だけ計算しておく"""
+  def __init__(self, name: str, reiwa_pos: Tuple[int, int], month_pos: Tuple[int, int], day_pos: Tuple[int, int],
+               header_fields: List[FieldSpec], profiles_pos: Tuple[int, int], name_col: int,
+               profile_fields: List[FieldSpec], detect: Optional[Callable[[Dict[Tuple[int, int], Any]], bool]] = None) -> None:
+    self.name = name
+    self.reiwa_pos = reiwa_pos
+    self.month_pos = month_pos
+    self.day_pos = day_pos
+    self.header_fields = header_fields
+    self.profiles_pos = profiles_pos
+    self.name_col = name_col
+    self.profile_fields = profile_fields
+    # detectがNoneの版は、どのファイルにも当てはまるものとして扱う
+    self.detect = detect
+    header_positions = [reiwa_pos, month_pos, day_pos] + [field.pos for field in header_fields]
+    self.header_max_row = max(pos[0] for pos in header_positions)
+    self.max_col = max([pos[1] for pos in header_positions] + [name_col] + [field.pos for field in profile_fields])
+
+  def signature(self) -> List[Any]:
+    # 解析キャッシュの版の判定に使う
+    return [self.name, self.reiwa_pos, self.month_pos, self.day_pos, [[f.name, f.pos] for f in self.header_fields],
+            self.profiles_pos, self.name_col, [[f.name, f.pos] for f in self.profile_fields]]
+
+  def parseDate(self, values: Dict[Tuple[int, int], Any]) -> ReiwaDate:
+    return parseReiwaDateValues(values.get(self.reiwa_pos), values.get(self.month_pos), values.get(self.day_pos))
+
+  def iterProfileRows(self, values: Dict[Tuple[int, int], Any]) -> Iterator[Tuple[str, int]]:
+    # 名前が空欄の行で園児の一覧は終わる
+    row = self.profiles_pos[0]
+    while True:
+      name = _cellText(values.get((row, self.name_col)))
+      if name.isspace() or name == "":
+        return
+      yield name, row
+      row += 1
+
+  def extract(self, values: Dict[Tuple[int, int], Any]) -> Tuple[StructDiaryPage, List[str]]:
+    warnings: List[str] = []
+    dt = self.parseDate(values)
+    header = {field.name: field.parse(values.get(field.pos), warnings) for field in self.header_fields}
+    profiles: Dict[str, StructChildDialyProfile] = {}
+    # 園児の一覧は列ごとにまとめて解釈し、警告は行ごとに元の順番で並べ直す
+    rows = list(self.iterProfileRows(values))
+    row_numbers = [row for _, row in rows]
+    field_names = [field.name for field in self.profile_fields]
+    columns: List[List[Any]] = []
+    warning_columns: List[List[List[str]]] = []
+    for field in self.profile_fields:
+      column, column_warnings = field.decodeColumn(values, row_numbers)
+      columns.append(column)
+      if column_warnings is not None:
+        warning_columns.append(column_warnings)
+    for index, ((name, _), row_values) in enumerate(zip(rows, zip(*columns))):
+      for column_warnings in warning_columns:
+        warnings.extend(column_warnings[index])
+      profile = StructChildDialyProfile(name, **dict(zip(field_names, row_values)))
+      if name in profiles:
+        warnings.append(f"注意(園児プロフィールを解析中): `{name}`は重複しています。このプロフィールをスキップします。")
+      profiles[name] = profile
+    return StructDiaryPage(dt, profiles=profiles, **header), warnings
+
+  def render(self, dt: ReiwaDate, dump: List[Any]) -> Dict[Tuple[int, int], Any]:
+    """listenPageのダンプを、このテンプレートの(行, 列) -> セルの値に戻す (extractの逆)"""
+    cells: Dict[Tuple[int, int], Any] = {self.reiwa_pos: dt.reiwa, self.month_pos: dt.month, self.day_pos: dt.day}
+    header = dict(zip(DUMP_HEADER_FIELDS, dump))
+    for field in self.header_fields:
+      cells[field.pos] = field.encode(header[field.name])
+    for row, profile_dump in enumerate(header["profiles"], self.profiles_pos[0]):
+      profile = dict(zip(DUMP_PROFILE_FIELDS, profile_dump))
+      cells[(row, self.name_col)] = profile["name"]
+      for field in self.profile_fields:
+        cells[(row, field.pos)] = field.encode(profile[field.name])
+    return {pos: value for pos, value in cells.items() if value is not None}
+
+# 現行の日誌テンプレート (上の*_POS・*_COLの定数の配置)
+DIARY_LAYOUT = SheetLayout(
+  "標準",
+  REIWA_POS, MONTH_POS, DAY_POS,
+  [
+    FieldSpec("weather", WEATHER_POS, parseWeather),
+    FieldSpec("temperature", TEMPERATURE_POS, parseTemperature, encode=encodeTemperature),
+    FieldSpec("humidity", HUMIDITY_POS, parseHumidity, encode=encodeHumidity),
+    FieldSpec("recorder", RECORDER_POS, parseRecorder),
+    FieldSpec("inspections", INSPECTIONS_POS, parseInspections, encode=encodeInspections),
+    FieldSpec("activities", ACTIVITIES_POS, listParser(splitActivities), encode=encodeList),
+    FieldSpec("day_flows", DAY_FLOWS_POS, parseDayFlows, encode=encodeDayFlows),
+    FieldSpec("home_contacts", HOME_CONTACTS_POS, listParser(splitHomeContacts), encode=encodeList),
+    FieldSpec("near_misses", NEAR_MISSES_POS, listParser(splitNearMisses), encode=encodeList),
+  ],
+  PROFILES_POS, NAME_COL,
+  [
+    FieldSpec("attendance", ATTEND_COL, codeParser(VALID_ATTENDANCE, "出欠", "出欠"), lookup=True,
+              encode=codeEncoder(VALID_ATTENDANCE)),
+    FieldSpec("abs_reason", REASON_COL, parseAbsenceReason, lookup=True),
+    FieldSpec("medicine", MEDICINE_COL, codeParser(VALID_MEDICINE, "くすり", "薬"), lookup=True,
+              encode=codeEncoder(VALID_MEDICINE)),
+    FieldSpec("excretion", EXCRETION_COL, codeParser(VALID_EXCRETION, "排泄", "排泄"), lookup=True,
+              encode=codeEncoder(VALID_EXCRETION)),
+    FieldSpec("eating", EATING_COL, codeParser(VALID_EATING, "食事", "食事"), lookup=True,
+              encode=codeEncoder(VALID_EATING)),
+    FieldSpec("sleeping", SLEEPING_COL, codeParser(VALID_SLEEPING, "睡眠", "睡眠"), lookup=True,
+              encode=codeEncoder(VALID_SLEEPING)),
+    FieldSpec("overview", OVERVIEW_COL, parseOverview),
+  ],
+)
+
+# 対応する日誌テンプレートの版。先頭から順にdetectを試し、最初に当てはまった版で解析する
+# (古い配置の日誌を復元するときは、detectを付けたSheetLayoutをDIARY_LAYOUTより前に追加する)
+TEMPLATE_LAYOUTS: List[SheetLayout] = [DIARY_LAYOUT]
+
+# すべての版について、ヘッダーとして読む最も下の行と最も右の列
+LAYOUTS_HEADER_MAX_ROW = max(layout.header_max_row for layout in TEMPLATE_LAYOUTS)
+LAYOUTS_MAX_COL = max(layout.max_col for layout in TEMPLATE_LAYOUTS)
+# (園児の一覧の開始行, 名前の列) の組
+LAYOUTS_PROFILE_ANCHORS = sorted({(layout.profiles_pos[0], layout.name_col) for layout in TEMPLATE_LAYOUTS})
+
+def detectLayout(values: Dict[Tuple[int, int], Any]) -> SheetLayout:
+  for layout in TEMPLATE_LAYOUTS:
+    if layout.detect is None or layout.detect(values):
+      return layout
+  return TEMPLATE_LAYOUTS[-1]
+
+def readWorksheetValues(sheet: "Worksheet", max_row: Optional[int] = None) -> Dict[Tuple[int, int], Any]:
+  """openpyxlのシートから、テンプレートで使う範囲のセルを行ごとにまとめて読み取る"""
+  values: Dict[Tuple[int, int], Any] = {}
+  ended = {anchor: False for anchor in LAYOUTS_PROFILE_ANCHORS}
+  next_rows = {anchor: anchor[0] for anchor in LAYOUTS_PROFILE_ANCHORS}
+  for row_index, row in enumerate(sheet.iter_rows(min_row=1, max_row=max_row, max_col=LAYOUTS_MAX_COL, values_only=True), 1):
+    for column_index, value in enumerate(row, 1):
+      if value is not None:
+        values[(row_index, column_index)] = value
+    if max_row is not None or row_index <= LAYOUTS_HEADER_MAX_ROW:
+      continue
+    # どの版の園児の一覧も終わったら、それより下は読まない
+    for anchor in LAYOUTS_PROFILE_ANCHORS:
+      if not ended[anchor] and row_index == next_rows[anchor]:
+        name = _cellText(values.get((row_index, anchor[1])))
+        if name.isspace() or name == "":
+          ended[anchor] = True
+        else:
+          next_rows[anchor] += 1
+    if all(ended.values()):
       break
-    raw_attendance = sheet.cell(PROFILES_POS[0] + current_child_index, ATTEND_COL).value
-    raw_attendance = raw_attendance if raw_attendance is not None else ""
-    attendance = str(raw_attendance).strip()
-    if attendance not in VALID_ATTENDANCE:
-      warnings.append(f"注意(出欠を解析中): `{attendance}`は有効な出欠ではありません。未選択として処理します。")
-      attendance = "---"
-    raw_abs_reason = sheet.cell(PROFILES_POS[0] + current_child_index, REASON_COL).value
-    raw_abs_reason = raw_abs_reason if raw_abs_reason is not None else ""
-    abs_reason = str(raw_abs_reason).strip()
-    if abs_reason == "":
-      abs_reason = None
-    elif abs_reason not in VALID_ABSENCE_REASONS:
-      warnings.append(f"注意(欠席理由を解析中): `{abs_reason}`は有効な欠席理由ではありません。未選択として処理します。")
-      abs_reason = None
-    raw_medicine = sheet.cell(PROFILES_POS[0] + current_child_index, MEDICINE_COL).value
-    raw_medicine = raw_medicine if raw_medicine is not None else ""
-    medicine = str(raw_medicine).strip()
-    if medicine not in VALID_MEDICINE:
-      warnings.append(f"注意(くすりを解析中): `{medicine}`は有効な薬ではありません。未選択として処理します。")
-      medicine = "---"
-    raw_excretion = sheet.cell(PROFILES_POS[0] + current_child_index, EXCRETION_COL).value
-    raw_excretion = raw_excretion if raw_excretion is not None else ""
-    excretion = str(raw_excretion).strip()
-    if excretion not in VALID_EXCRETION:
-      warnings.append(f"注意(排泄を解析中): `{excretion}`は有効な排泄ではありません。未選択として処理します。")
-      excretion = "---"
-    raw_eating = sheet.cell(PROFILES_POS[0] + current_child_index, EATING_COL).value
-    raw_eating = raw_eating if raw_eating is not None else ""
-    eating = str(raw_eating).strip()
-    if eating not in VALID_EATING:
-      warnings.append(f"注意(食事を解析中): `{eating}`は有効な食事ではありません。未選択として処理します。")
-      eating = "---"
-    raw_sleeping = sheet.cell(PROFILES_POS[0] + current_child_index, SLEEPING_COL).value
-    raw_sleeping = raw_sleeping if raw_sleeping is not None else ""
-    sleeping = str(raw_sleeping).strip()
-    if sleeping not in VALID_SLEEPING:
-      warnings.append(f"注意(睡眠を解析中): `{sleeping}`は有効な睡眠ではありません。未選択として処理します。")
-      sleeping = "---"
-    raw_overview = sheet.cell(PROFILES_POS[0] + current_child_index, OVERVIEW_COL).value
-    raw_overview = raw_overview if raw_overview is not None else ""
-    overview = str(raw_overview).strip()
-    if overview == "" or overview.isspace():
-      overview = None
-    profile = StructChildDialyProfile(
-      name, VALID_ATTENDANCE[attendance], abs_reason, VALID_MEDICINE[medicine], VALID_EXCRETION[excretion], VALID_EATING[eating], VALID_SLEEPING[sleeping], overview
-    )
-    if name in profiles:
-      warnings.append(f"注意(園児プロフィールを解析中): `{name}`は重複しています。このプロフィールをスキップします。")
-    profiles[name] = profile
-    current_child_index += 1
-  dt = ReiwaDate(reiwa, month, day)
-  return StructDiaryPage(dt, weather, temperature, humidity, recorder, inspections, activities, day_flows, home_contacts, near_misses, profiles), warnings
-
-def parseXlsx(xlsx_path: Path) -> Tuple[StructDiaryPage, List[str]]:
+  return values
+
+def sheetValues(sheet: Union["Worksheet", "NativeSheet"]) -> Dict[Tuple[int, int], Any]:
+  if isinstance(sheet, NativeSheet):
+    return sheet.values
+  return readWorksheetValues(sheet)
+
+def parseReiwaDate(sheet: Union["Worksheet", "NativeSheet"]) -> ReiwaDate:
+  values = sheetValues(sheet)
+  return detectLayout(values).parseDate(values)
+
+def createDiaryFromXlsxSheet(sheet: Union["Worksheet", "NativeSheet"]) -> Tuple[StructDiaryPage, List[str]]:
+  values = sheetValues(sheet)
+  return detectLayout(values).extract(values)
+
+class XlsxFormatError(Exception):
+  """nativeエンジンが扱えない形式のときに送出され、openpyxlでの読み直しに切り替える"""
+  pass
+
+class NativeSheet:
+  """nativeエンジンで読んだ、日誌テンプレートで使う範囲のセルの(行, 列) -> 値だけを持つシート"""
+  def __init__(self, values: Dict[Tuple[int, int], Any]) -> None:
+    self.values = values
+
+_MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_REL_ID_ATTR = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+_PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_SHARED_STRINGS_REL_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings"
+# 日付と解釈されることのない組み込みの表示形式 (これ以外の数値セルは日付の可能性があるのでopenpyxlに任せる)
+_NON_DATE_NUM_FMT_IDS = set(range(0, 14)) | set(range(37, 45)) | {48, 49}
+_DATE_FORMAT_STRIP_RE = re.compile(r'".*?"|\[(?!hh?\]|mm?\]|ss?\])[^\]]*\]')
+_DATE_FORMAT_CHAR_RE = re.compile(r"(?<![_\\])[dmhysDMHYS]")
+
+def _splitCellRef(ref: str) -> Tuple[int, int]:
+  column = 0
+  for i, c in enumerate(ref):
+    if "A" <= c <= "Z":
+      column = column * 26 + (ord(c) - 64)
+    else:
+      return int(ref[i:]), column
+  raise XlsxFormatError(f"セル番地`{ref}`を解釈できません。")
+
+def _textContent(element: ElementTree.Element) -> str:
+  # openpyxlと同じく、<t>と<r><t>だけを連結し、ふりがな(<rPh>)は含めない
+  snippets: List[str] = []
+  plain = element.find(f"{_MAIN_NS}t")
+  if plain is not None and plain.text is not None:
+    snippets.append(plain.text)
+  for run in element.iterfind(f"{_MAIN_NS}r"):
+    run_text = run.find(f"{_MAIN_NS}t")
+    if run_text is not None and run_text.text is not None:
+      snippets.append(run_text.text)
+  return "".join(snippets)
+
+def _castNumber(value: str) -> Union[int, float]:
+  if "." in value or "E" in value or "e" in value:
+    return float(value)
+  return int(value)
+
+def _resolvePartPath(base_dir: str, target: str) -> str:
+  if target.startswith("/"):
+    return target[1:]
+  return posixpath.normpath(posixpath.join(base_dir, target))
+
+def _findSheetParts(zf: zipfile.ZipFile, sheet_name: str) -> Tuple[str, Optional[str]]:
+  try:
+    workbook = ElementTree.fromstring(zf.read("xl/workbook.xml"))
+    rels = ElementTree.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+  except KeyError:
+    raise XlsxFormatError("workbook.xmlが見つかりません。")
+  rel_id: Optional[str] = None
+  for sheet in workbook.iter(f"{_MAIN_NS}sheet"):
+    if sheet.get("name") == sheet_name:
+      rel_id = sheet.get(_REL_ID_ATTR)
+      break
+  if rel_id is None:
+    raise XlsxFormatError(f"{sheet_name}が見つかりません。")
+  sheet_path: Optional[str] = None
+  shared_strings_path: Optional[str] = None
+  for rel in rels.iter(f"{_PKG_REL_NS}Relationship"):
+    if rel.get("Id") == rel_id:
+      sheet_path = _resolvePartPath("xl", rel.get("Target", ""))
+    elif rel.get("Type") == _SHARED_STRINGS_REL_TYPE:
+      shared_strings_path = _resolvePartPath("xl", rel.get("Target", ""))
+  if sheet_path is None:
+    raise XlsxFormatError(f"{sheet_name}の実体が見つかりません。")
+  return sheet_path, shared_strings_path
+
+def _readSharedStrings(zf: zipfile.ZipFile, path: str, needed: set) -> Dict[int, str]:
+  # 必要な番号までしか読まない
+  last = max(needed)
+  strings: Dict[int, str] = {}
+  index = 0
+  with zf.open(path) as f:
+    for _, element in ElementTree.iterparse(f):
+      if element.tag != f"{_MAIN_NS}si":
+        continue
+      if index in needed:
+        strings[index] = _textContent(element).replace("x005F_", "")
+      element.clear()
+      if index >= last:
+        break
+      index += 1
+  return strings
+
+def _isDateFormat(format_code: str) -> bool:
+  # openpyxlのis_date_formatと同じ判定 (最初の区間だけを見て、""で囲んだ文字列と[色]などの指定は除く)
+  format_code = _DATE_FORMAT_STRIP_RE.sub("", format_code.split(";")[0])
+  return _DATE_FORMAT_CHAR_RE.search(format_code) is not None
+
+def _readNonDateStyleIds(zf: zipfile.ZipFile) -> set:
+  try:
+    styles = ElementTree.fromstring(zf.read("xl/styles.xml"))
+  except KeyError:
+    return {0}
+  cell_xfs = styles.find(f"{_MAIN_NS}cellXfs")
+  if cell_xfs is None:
+    return {0}
+  # ユーザー定義の表示形式 (`0"月"`など) は、書式の文字列で日付かどうかを判定する
+  custom_formats: Dict[int, str] = {}
+  num_fmts = styles.find(f"{_MAIN_NS}numFmts")
+  if num_fmts is not None:
+    for num_fmt in num_fmts.iterfind(f"{_MAIN_NS}numFmt"):
+      custom_formats[int(num_fmt.get("numFmtId", "0"))] = num_fmt.get("formatCode", "")
+  style_ids = set()
+  for i, xf in enumerate(cell_xfs.iterfind(f"{_MAIN_NS}xf")):
+    num_fmt_id = int(xf.get("numFmtId", "0"))
+    if num_fmt_id in custom_formats:
+      if not _isDateFormat(custom_formats[num_fmt_id]):
+        style_ids.add(i)
+    elif num_fmt_id in _NON_DATE_NUM_FMT_IDS:
+      style_ids.add(i)
+  return style_ids
+
+def _readSheetCells(f: Any, max_col: int, max_row: Optional[int] = None) -> Dict[Tuple[int, int], Tuple[str, Optional[str], int]]:
+  cells: Dict[Tuple[int, int], Tuple[str, Optional[str], int]] = {}
+  row_counter = 0
+  # 園児の一覧は名前が空欄の行で終わるので、どの版の一覧も終わったらそこから先は読まない
+  # (行が丸ごと省略されている場合も、名前が空欄とみなす)
+  next_profile_rows: Dict[Tuple[int, int], int] = {anchor: anchor[0] for anchor in LAYOUTS_PROFILE_ANCHORS}
+  row_tag = f"{_MAIN_NS}row"
+  for _, row in ElementTree.iterparse(f):
+    if row.tag != row_tag:
+      continue
+    r = row.get("r")
+    row_counter = int(float(r)) if r is not None else row_counter + 1
+    if max_row is not None and row_counter > max_row:
+      break
+    for anchor in [anchor for anchor, next_row in next_profile_rows.items() if row_counter > next_row]:
+      del next_profile_rows[anchor]
+    if len(next_profile_rows) == 0:
+      break
+    col_counter = 0
+    for c in row.iterfind(f"{_MAIN_NS}c"):
+      ref = c.get("r")
+      if ref is not None:
+        _, col_counter = _splitCellRef(ref)
+      else:
+        col_counter += 1
+      if col_counter > max_col:
+        continue
+      data_type = c.get("t", "n")
+      formula = c.find(f"{_MAIN_NS}f")
+      if formula is not None:
+        if formula.get("t") in ("shared", "array") or formula.text is None:
+          raise XlsxFormatError("共有数式・配列数式はnativeエンジンでは扱えません。")
+        cells[(row_counter, col_counter)] = ("f", "=" + formula.text, 0)
+      elif data_type == "inlineStr":
+        inline = c.find(f"{_MAIN_NS}is")
+        cells[(row_counter, col_counter)] = ("inlineStr", None if inline is None else _textContent(inline), 0)
+      else:
+        cells[(row_counter, col_counter)] = (data_type, c.findtext(f"{_MAIN_NS}v", None) or None, int(c.get("s", "0")))
+    row.clear()
+    for anchor in [anchor for anchor, next_row in next_profile_rows.items() if row_counter == next_row]:
+      name = cells.get((row_counter, anchor[1]))
+      if name is None or name[1] is None or (name[0] != "s" and (name[1] == "" or name[1].isspace())):
+        del next_profile_rows[anchor]
+      else:
+        next_profile_rows[anchor] += 1
+    if len(next_profile_rows) == 0:
+      break
+  return cells
+
+class ArchiveMember(NamedTuple):
+  """zipファイルの中のエクセルファイル。解析で使う分だけPathと同じように扱える (name, exists, stat)"""
+  archive: Path
+  member: str
+
+  @property
+  def name(self) -> str:
+    return posixpath.basename(self.member)
+
+  def exists(self) -> bool:
+    return self.archive.exists()
+
+  def stat(self) -> os.stat_result:
+    # zipファイルが変わったら、中のファイルも変わったものとして扱う
+    return self.archive.stat()
+
+  def __str__(self) -> str:
+    return f"{self.archive}{ARCHIVE_MEMBER_SEPARATOR}{self.member}"
+
+def openZipArchive(archive_path: Path) -> zipfile.ZipFile:
+  # metadata_encodingはPython 3.11から使える。それより古いPythonでは日本語のファイル名が文字化けするが、中身は読める
+  if sys.version_info >= (3, 11):
+    return zipfile.ZipFile(str(archive_path), metadata_encoding=ZIP_METADATA_ENCODING)
+  return zipfile.ZipFile(str(archive_path))
+
+class ArchiveCache:
+  """開いたままにしておくzipファイル (解析を行うプロセスごとに1つ)
+  数千件のエクセルファイルが入ったzipでも、中央ディレクトリの読み込みは1回で済ませる"""
+  def __init__(self, max_archives: int = 4) -> None:
+    self.max_archives = max_archives
+    # zipファイル -> ((サイズ, 更新時刻), 開いたZipFile)
+    self.archives: Dict[Path, Tuple[Tuple[int, int], zipfile.ZipFile]] = {}
+    self.pid = os.getpid()
+
+  def open(self, archive_path: Path, stamp: Tuple[int, int]) -> zipfile.ZipFile:
+    # forkしたプロセスプールは親の開いたファイルの読み込み位置を共有してしまうので、親から引き継いだものは使わない
+    if self.pid != os.getpid():
+      self.close()
+      self.pid = os.getpid()
+    cached = self.archives.pop(archive_path, None)
+    if cached is not None and cached[0] == stamp:
+      self.archives[archive_path] = cached
+      return cached[1]
+    if cached is not None:
+      cached[1].close()
+    while len(self.archives) >= self.max_archives:
+      # 一番長く使っていないものから閉じる
+      self.archives.pop(next(iter(self.archives)))[1].close()
+    archive = openZipArchive(archive_path)
+    self.archives[archive_path] = (stamp, archive)
+    return archive
+
+  def close(self):
+    # 開いている間はWindowsでzipファイルを削除・置き換えできないので、一区切りごとに閉じる
+    for _, archive in self.archives.values():
+      archive.close()
+    self.archives = {}
+
+OPEN_ARCHIVES = ArchiveCache()
+
+def openXlsxFile(xlsx_path: Union[Path, ArchiveMember]) -> BinaryIO:
+  if isinstance(xlsx_path, ArchiveMember):
+    file_stat = xlsx_path.stat()
+    archive = OPEN_ARCHIVES.open(xlsx_path.archive, (file_stat.st_size, file_stat.st_mtime_ns))
+    try:
+      return io.BytesIO(archive.read(xlsx_path.member))
+    except (zipfile.BadZipFile, KeyError) as e:
+      raise AppError(f"エラー: zipファイルの中の{xlsx_path.member}を読み込めません。: {e}")
+  return open(xlsx_path, "rb")
+
+def loadNativeSheet(xlsx_path: Union[Path, ArchiveMember], sheet_name: str = SHEET_NAME, max_row: Optional[int] = None) -> NativeSheet:
+  """xlsxのzipからsheet_nameと共有文字列だけを読み、日誌テンプレートで使う範囲のセルを取り出す"""
+  try:
+    with openXlsxFile(xlsx_path) as xlsx_file, zipfile.ZipFile(xlsx_file) as zf:
+      sheet_path, shared_strings_path = _findSheetParts(zf, sheet_name)
+      with zf.open(sheet_path) as f:
+        raw_cells = _readSheetCells(f, LAYOUTS_MAX_COL, max_row)
+      needed_strings = {int(text) for data_type, text, _ in raw_cells.values() if data_type == "s" and text is not None}
+      shared_strings: Dict[int, str] = {}
+      if len(needed_strings) > 0:
+        if shared_strings_path is None:
+          raise XlsxFormatError("共有文字列が見つかりません。")
+        shared_strings = _readSharedStrings(zf, shared_strings_path, needed_strings)
+      non_date_style_ids: Optional[set] = None
+      values: Dict[Tuple[int, int], Any] = {}
+      for pos, (data_type, text, style_id) in raw_cells.items():
+        if data_type == "f" or data_type == "inlineStr" or text is None:
+          values[pos] = text
+        elif data_type == "n":
+          if style_id != 0:
+            if non_date_style_ids is None:
+              non_date_style_ids = _readNonDateStyleIds(zf)
+            if style_id not in non_date_style_ids:
+              raise XlsxFormatError("日付の可能性がある数値セルはnativeエンジンでは扱えません。")
+          values[pos] = _castNumber(text)
+        elif data_type == "s":
+          values[pos] = shared_strings[int(text)]
+        elif data_type == "b":
+          values[pos] = bool(int(text))
+        elif data_type in ("str", "e"):
+          values[pos] = text
+        else:
+          raise XlsxFormatError(f"セルの型`{data_type}`はnativeエンジンでは扱えません。")
+  except (zipfile.BadZipFile, ElementTree.ParseError, KeyError, ValueError) as e:
+    raise XlsxFormatError(str(e))
+  return NativeSheet(values)
+
+def parseXlsx(xlsx_path: Union[Path, ArchiveMember], engine: str = XLSX_ENGINE) -> Tuple[StructDiaryPage, List[str]]:
+  page, warnings, _ = parseXlsxWithEngine(xlsx_path, engine)
+  return page, warnings
+
+def parseXlsxWithEngine(xlsx_path: Union[Path, ArchiveMember], engine: str = XLSX_ENGINE) -> Tuple[StructDiaryPage, List[str], str]:
+  # 3番目の戻り値は実際に読み込んだエンジン (nativeで読めずにopenpyxlで読み直した場合は"openpyxl")
   if not xlsx_path.exists():
     raise FileNotFoundError(f"ファイルが見つかりません。: {xlsx_path}")
-  wb: Workbook = openpyxl.load_workbook(str(xlsx_path))
+  if engine not in XLSX_ENGINES:
+    raise AppError(f"エラー: 読み込みエンジン`{engine}`は存在しません。")
+  if engine == "native":
+    try:
+      with STAGE_TIMER.measure("load"):
+        native_sheet = loadNativeSheet(xlsx_path)
+    except XlsxFormatError:
+      pass
+    else:
+      with STAGE_TIMER.measure("extract"):
+        page, warnings = createDiaryFromXlsxSheet(native_sheet)
+      return page, warnings, "native"
+  with STAGE_TIMER.measure("load"), openXlsxFile(xlsx_path) as xlsx_file:
+    wb: Workbook = loadOpenpyxl().load_workbook(xlsx_file)
   sheet: Worksheet = wb[SHEET_NAME]
   try:
-    page, warnings = createDiaryFromXlsxSheet(sheet)
+    with STAGE_TIMER.measure("extract"):
+      page, warnings = createDiaryFromXlsxSheet(sheet)
   except AppError:
     raise
   finally:
     wb.close()
     
-  return page, warnings
+  return page, warnings, "openpyxl"
+
+def readXlsxDate(xlsx_path: Union[Path, ArchiveMember], engine: str = XLSX_ENGINE) -> ReiwaDate:
+  """令和年度・月・日のセルだけを読む (日誌全体は解析しない)"""
+  if not xlsx_path.exists():
+    raise FileNotFoundError(f"ファイルが見つかりません。: {xlsx_path}")
+  # 版の判別に使うセルも日付と一緒に読む
+  max_row = LAYOUTS_HEADER_MAX_ROW
+  if engine == "native":
+    try:
+      native_sheet = loadNativeSheet(xlsx_path, max_row=max_row)
+    except XlsxFormatError:
+      pass
+    else:
+      return parseReiwaDate(native_sheet)
+  # 読み込み専用モードは閉じるまでファイルを読みに行く
+  with openXlsxFile(xlsx_path) as xlsx_file:
+    wb: Workbook = loadOpenpyxl().load_workbook(xlsx_file, read_only=True)
+    try:
+      values: Dict[Tuple[int, int], Any] = {}
+      for row_index, row in enumerate(wb[SHEET_NAME].iter_rows(max_row=max_row, max_col=LAYOUTS_MAX_COL, values_only=True), 1):
+        for column_index, value in enumerate(row, 1):
+          values[(row_index, column_index)] = value
+    finally:
+      wb.close()
+  return parseReiwaDate(NativeSheet(values))
 
 def listenPage(page: StructDiaryPage) -> List[Any]:
     n_belongs = len(page.profiles)
@@ -471,91 +1669,1055 @@ def listenPage(page: StructDiaryPage) -> List[Any]:
     ]
     return dump
 
-def loadListenDiaryPages(xlsx_paths: List[Path]) -> Dict[int, Dict[int, Dict[int, List[Any]]]]:
-  listen_diary_pages: Dict[int, Dict[int, Dict[int, List[Any]]]] = {}
+class ChildRoster:
+  """クラスの園児の名前に番号を振る。同じ名前の文字列は全ページで1つだけ持つ"""
+  __slots__ = ("ids", "names")
+
+  def __init__(self) -> None:
+    self.ids: Dict[str, int] = {}
+    self.names: List[str] = []
+
+  def intern(self, name: str) -> int:
+    child_id = self.ids.get(name)
+    if child_id is None:
+      child_id = len(self.names)
+      name = sys.intern(name)
+      self.ids[name] = child_id
+      self.names.append(name)
+    return child_id
+
+# MonthStoreで選択肢のコードがNone (未選択) であることを表す値
+MISSING_CODE = -1
+
+class MonthStore:
+  """ひと月分の日誌のダンプ。園児のプロフィールは項目ごとの配列にまとめて持つ
+
+  日 -> ダンプの辞書と同じように読めて、取り出すたびにlistenPageと同じ形のダンプを組み立て直す
+  """
+  __slots__ = ("roster", "headers", "spans", "name_ids", "codes", "abs_reasons", "overviews")
+
+  # プロフィールのダンプのうち、選択肢のコードの位置 (出欠・くすり・排泄・食事・睡眠)
+  CODE_INDEXES = (1, 3, 4, 5, 6)
+
+  def __init__(self, roster: ChildRoster) -> None:
+    self.roster = roster
+    # 日 -> プロフィール以外のダンプ
+    self.headers: Dict[int, List[Any]] = {}
+    # 日 -> その日のプロフィールが入っている配列の範囲
+    self.spans: Dict[int, Tuple[int, int]] = {}
+    self.name_ids = array("i")
+    self.codes = [array("b") for _ in MonthStore.CODE_INDEXES]
+    self.abs_reasons: List[Optional[str]] = []
+    self.overviews: List[Optional[str]] = []
+
+  def add(self, day: int, dump: List[Any]):
+    start = len(self.name_ids)
+    for profile_dump in dump[-1]:
+      self.name_ids.append(self.roster.intern(profile_dump[0]))
+      for column, index in zip(self.codes, MonthStore.CODE_INDEXES):
+        code = profile_dump[index]
+        column.append(MISSING_CODE if code is None else code)
+      abs_reason = profile_dump[2]
+      self.abs_reasons.append(sys.intern(abs_reason) if abs_reason is not None else None)
+      self.overviews.append(profile_dump[7])
+    self.headers[day] = dump[:-1]
+    self.spans[day] = (start, len(self.name_ids))
+
+  def __contains__(self, day: int) -> bool:
+    return day in self.headers
+
+  def __iter__(self) -> Iterator[int]:
+    return iter(self.headers)
+
+  def __len__(self) -> int:
+    return len(self.headers)
+
+  def __getitem__(self, day: int) -> List[Any]:
+    start, end = self.spans[day]
+    names = self.roster.names
+    attendance, medicine, excretion, eating, sleeping = [
+      [None if code == MISSING_CODE else code for code in column[start:end]] for column in self.codes
+    ]
+    profile_dumps = [
+      [names[self.name_ids[start + i]], attendance[i], self.abs_reasons[start + i], medicine[i],
+       excretion[i], eating[i], sleeping[i], self.overviews[start + i]]
+      for i in range(end - start)
+    ]
+    return self.headers[day] + [profile_dumps]
+
+def parseXlsxToListen(xlsx_path: Union[Path, ArchiveMember], engine: str = XLSX_ENGINE,
+                      trace_memory: bool = False) -> Tuple[ReiwaDate, List[Any], List[str], Dict[str, Any]]:
+  # プロセスプールから呼び出されるため、受け渡しの軽いダンプ形式で返す
+  # 4番目の戻り値は段階ごとの処理時間など、実行レポート用の計測値
+  STAGE_TIMER.reset()
+  if trace_memory:
+    import tracemalloc
+    tracemalloc.start()
+  try:
+    diary_page, warnings, used_engine = parseXlsxWithEngine(xlsx_path, engine)
+    with STAGE_TIMER.measure("listen"):
+      dump = listenPage(diary_page)
+  finally:
+    stats: Dict[str, Any] = STAGE_TIMER.reset()
+    if trace_memory:
+      stats["alloc_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+      tracemalloc.stop()
+  # 分割の時間はセルの取り出しの時間に含まれているので差し引く
+  stats["extract"] = stats.get("extract", 0.0) - stats.get("split", 0.0)
+  # nativeで読めずにopenpyxlで読み直したファイルが実行レポートでわかるようにする
+  stats["engine"] = used_engine
+  return diary_page.dt, dump, warnings, stats
+
+def tryParseXlsxToListen(xlsx_path: Union[Path, ArchiveMember], engine: str = XLSX_ENGINE,
+                         trace_memory: bool = False) -> Tuple[Optional[ReiwaDate], Optional[List[Any]], List[str], Dict[str, Any]]:
+  # 試し実行用: 解析できないファイルでも中断せず、エラーをstatsの"error"に入れて返す
+  try:
+    return parseXlsxToListen(xlsx_path, engine, trace_memory)
+  except AppError as e:
+    return None, None, [], {"error": e.message}
+
+def writeDiaryXlsx(xlsx_path: Path, cells: Dict[Tuple[int, int], Any]):
+  # 書き込み専用モードは行を上から順に流し込むだけなので、通常のブックより速く、メモリも使わない
+  wb = loadOpenpyxl().Workbook(write_only=True)
+  sheet = wb.create_sheet(SHEET_NAME)
+  max_row = max(row for row, _ in cells)
+  max_col = max(column for _, column in cells)
+  rows: List[List[Any]] = [[None] * max_col for _ in range(max_row)]
+  for (row, column), value in cells.items():
+    rows[row - 1][column - 1] = value
+  for row_values in rows:
+    sheet.append(row_values)
+  wb.save(str(xlsx_path))
+
+def exportDiaryDay(xlsx_path: Path, dt: ReiwaDate, dump: List[Any], verify: bool = False,
+                   engine: str = XLSX_ENGINE) -> Optional[str]:
+  """1日分のダンプを日誌エクセルファイルに書き出す。verifyなら読み直して元のダンプと比べ、違えば理由を返す"""
+  writeDiaryXlsx(xlsx_path, DIARY_LAYOUT.render(dt, dump))
+  if not verify:
+    return None
+  parsed_dt, parsed_dump, warnings, _ = parseXlsxToListen(xlsx_path, engine)
+  if parsed_dt != dt or parsed_dump != dump:
+    detail = "\n".join(warnings)
+    return f"{xlsx_path.name}: 読み直した内容がストレージのデータと一致しません。" + (f"\n{detail}" if detail != "" else "")
+  return None
+
+def parseCacheVersion() -> str:
+  # 日誌テンプレートの定数が変わると、古いキャッシュは自動的に使われなくなる
+  template = [
+    PARSE_CACHE_FORMAT, SHEET_NAME, [layout.signature() for layout in TEMPLATE_LAYOUTS], REIWA_NENDO_RANGE,
+    sorted(VALID_ABSENCE_REASONS), sorted(VALID_WEATHERS), VALID_ATTENDANCE, VALID_MEDICINE,
+    VALID_EXCRETION, VALID_EATING, VALID_SLEEPING,
+  ]
+  dumped = json.dumps(template, ensure_ascii=False, sort_keys=True)
+  return hashlib.sha256(dumped.encode("utf-8")).hexdigest()[:16]
+
+class ParseCache:
+  """エクセルファイルの内容のハッシュをキーに、listenPageのダンプと警告を保存するキャッシュ"""
+  def __init__(self, cache_dir: Path, max_bytes: int = PARSE_CACHE_MAX_BYTES) -> None:
+    self.cache_dir = cache_dir
+    self.entries_dir = cache_dir.joinpath("entries")
+    self.index_path = cache_dir.joinpath("index.json")
+    self.max_bytes = max_bytes
+    self.version = parseCacheVersion()
+    # ファイルパス -> [サイズ, 更新時刻, ハッシュ] (内容を読まずにハッシュを得るための索引)
+    self.index: Dict[str, List[Any]] = {}
+    self.entries_dir.mkdir(parents=True, exist_ok=True)
+    try:
+      with open(self.index_path, "r", encoding="utf-8") as f:
+        saved = json.load(f)
+    except (OSError, ValueError):
+      saved = None
+    if isinstance(saved, dict) and saved.get("version") == self.version:
+      self.index = saved.get("files", {})
+    elif isinstance(saved, dict):
+      # テンプレートの定数が変わった古いキャッシュだけを捨てる
+      self.clear()
+    # 索引が無い・壊れている場合 (前回の実行が途中で止まった場合など) は、索引だけを作り直す
+    # (エントリーはそれぞれ版を持っているので、そのまま使える)
+
+  def clear(self):
+    self.index = {}
+    for entry_path in self.entries_dir.iterdir():
+      entry_path.unlink()
+
+  def digest(self, xlsx_path: Union[Path, ArchiveMember]) -> str:
+    file_stat = xlsx_path.stat()
+    key = str(xlsx_path)
+    known = self.index.get(key)
+    if known is not None and known[0] == file_stat.st_size and known[1] == file_stat.st_mtime_ns:
+      return known[2]
+    hasher = hashlib.sha256()
+    with openXlsxFile(xlsx_path) as f:
+      for chunk in iter(lambda: f.read(1024 * 1024), b""):
+        hasher.update(chunk)
+    digest = hasher.hexdigest()
+    self.index[key] = [file_stat.st_size, file_stat.st_mtime_ns, digest]
+    return digest
+
+  def get(self, xlsx_path: Union[Path, ArchiveMember]) -> Optional[Tuple[ReiwaDate, List[Any], List[str]]]:
+    entry_path = self.entries_dir.joinpath(f"{self.digest(xlsx_path)}.json")
+    try:
+      with open(entry_path, "r", encoding="utf-8") as f:
+        entry = json.load(f)
+    except (OSError, ValueError):
+      return None
+    if entry.get("version") != self.version:
+      return None
+    # 更新時刻を最終利用時刻として使い、古いものから削除する
+    os.utime(entry_path)
+    return ReiwaDate(*entry["date"]), entry["dump"], entry["warnings"]
+
+  def put(self, xlsx_path: Union[Path, ArchiveMember], dt: ReiwaDate, dump: List[Any], warnings: List[str]):
+    entry = {"version": self.version, "date": [dt.reiwa, dt.month, dt.day], "dump": dump, "warnings": warnings}
+    entry_path = self.entries_dir.joinpath(f"{self.digest(xlsx_path)}.json")
+    writeFileAtomic(entry_path, json.dumps(entry, ensure_ascii=False))
+
+  def save(self):
+    entry_paths = sorted(self.entries_dir.glob("*.json"), key=lambda p: p.stat().st_mtime_ns, reverse=True)
+    total = 0
+    for entry_path in entry_paths:
+      total += entry_path.stat().st_size
+      if total > self.max_bytes:
+        entry_path.unlink()
+    # 存在しなくなったファイルの索引は持ち越さない
+    self.index = {key: known for key, known in self.index.items()
+                  if os.path.exists(key.split(ARCHIVE_MEMBER_SEPARATOR, 1)[0])}
+    writeFileAtomic(self.index_path, json.dumps({"version": self.version, "files": self.index}, ensure_ascii=False))
+
+def resolveWorkers(workers: int) -> int:
+  if workers < 0:
+    raise AppError(f"エラー: プロセス数`{workers}`は0以上の整数である必要があります。")
+  if workers == 0:
+    return os.cpu_count() or 1
+  return workers
+
+def createProcessPool(workers: int) -> "ProcessPoolExecutor":
+  # multiprocessingは読み込みに時間がかかるので、並列処理を使うときだけ読み込む
+  from concurrent.futures import ProcessPoolExecutor
+  return ProcessPoolExecutor(max_workers=workers)
+
+ParsedXlsx = Tuple[Union[Path, ArchiveMember], Tuple[Optional[ReiwaDate], Optional[List[Any]], List[str], Dict[str, Any]]]
+
+def parseXlsxChunk(parse: Callable[[Any], Any], xlsx_paths: List[Union[Path, ArchiveMember]],
+                   close_archives: bool = False) -> List[Tuple[Any, Optional[Exception]]]:
+  # 1件が失敗しても同じまとまりの他のファイルの結果を失わないよう、ファイルごとに(結果, 例外)を返す
+  outcomes: List[Tuple[Any, Optional[Exception]]] = []
   for xlsx_path in xlsx_paths:
-    print(f" ----- {xlsx_path.name}を解析中 ----- ")
-    diary_page, warnings = parseXlsx(xlsx_path)
-    if len(warnings) > 0:
-      print("解析を完了しましたが、以下の警告があります。")
-      for warning in warnings:
-        print(warning)
-    if diary_page.dt.reiwa not in listen_diary_pages:
-      listen_diary_pages[diary_page.dt.reiwa] = {}
-    if diary_page.dt.month not in listen_diary_pages[diary_page.dt.reiwa]:
-      listen_diary_pages[diary_page.dt.reiwa][diary_page.dt.month] = {}
-    if diary_page.dt.day in listen_diary_pages[diary_page.dt.reiwa][diary_page.dt.month]:
-      raise AppError("エラー: 令和{diary_page.dt.reiwa}年{diary_page.dt.month}月{diary_page.dt.day}日の日誌が重複しています。")
-    listen_diary_pages[diary_page.dt.reiwa][diary_page.dt.month][diary_page.dt.day] = listenPage(diary_page)
+    try:
+      outcomes.append((parse(xlsx_path), None))
+    except Exception as e:
+      outcomes.append((None, e))
+  if close_archives:
+    OPEN_ARCHIVES.close()
+  return outcomes
+
+def parseXlsxFiles(xlsx_paths: Iterable[Union[Path, ArchiveMember]], workers: int = 1, engine: str = XLSX_ENGINE,
+                   cache: Optional[ParseCache] = None, executor: Optional["ProcessPoolExecutor"] = None,
+                   trace_memory: bool = False, keep_errors: bool = False, close_archives: bool = False) -> Iterator[ParsedXlsx]:
+  """(ファイル, 解析結果)を入力順に返すイテレータ。入力はジェネレータでもよく、読み進めた分だけキャッシュと照合する
+  プロセスプールには呼び出した時点で先頭の数件を投入しておき、受け取った分だけ次のファイルを投入する
+  keep_errorsがTrueなら、解析できなかったファイルは日付とダンプがNoneの結果として返す
+  close_archivesがTrueなら、プロセスプールは投入したまとまりごとに開いたzipファイルを閉じる (プールを使い続ける監視用)"""
+  parse = partial(tryParseXlsxToListen if keep_errors else parseXlsxToListen, engine=engine, trace_memory=trace_memory)
+  paths = iter(xlsx_paths)
+  # (ファイル, キャッシュの結果, 解析中のFuture, Futureの結果の中の位置) を投入した順に並べる
+  window: Deque[Tuple[Union[Path, ArchiveMember], Optional[Tuple[ReiwaDate, List[Any], List[str]]], Optional["Future"], int]] = deque()
+  window_size = max(workers, 1) * PARSE_WINDOW_PER_WORKER
+
+  def submit() -> bool:
+    # 次のファイルを最大PARSE_CHUNK_SIZE件読み、キャッシュに無いものをまとめて投入する
+    chunk: List[Union[Path, ArchiveMember]] = []
+    entries: List[Tuple[Union[Path, ArchiveMember], Optional[Tuple[ReiwaDate, List[Any], List[str]]]]] = []
+    for xlsx_path in itertools.islice(paths, PARSE_CHUNK_SIZE if executor is not None else 1):
+      hit = cache.get(xlsx_path) if cache is not None else None
+      if hit is None:
+        chunk.append(xlsx_path)
+      entries.append((xlsx_path, hit))
+    future = executor.submit(parseXlsxChunk, parse, chunk, close_archives) if executor is not None and len(chunk) > 0 else None
+    index = 0
+    for xlsx_path, hit in entries:
+      window.append((xlsx_path, hit, future, index if hit is None else -1))
+      index += hit is None
+    return len(entries) > 0
+
+  if executor is not None:
+    while len(window) < window_size and submit():
+      pass
+
+  def results() -> Iterator[ParsedXlsx]:
+    while len(window) > 0 or submit():
+      xlsx_path, hit, future, index = window.popleft()
+      if executor is not None and len(window) < window_size:
+        submit()
+      if hit is not None:
+        yield xlsx_path, (hit[0], hit[1], hit[2], {"cached": True})
+        continue
+      if future is not None:
+        # 例外は直列で解析した場合と同じく、そのファイルの順番が来たときに送出する
+        outcome, error = future.result()[index]
+        if error is not None:
+          raise error
+      else:
+        outcome = parse(xlsx_path)
+      dt, dump, warnings, stats = outcome
+      if cache is not None and dt is not None:
+        cache.put(xlsx_path, dt, dump, warnings)
+      yield xlsx_path, (dt, dump, warnings, stats)
+  return results()
+
+def collectListenDiaryPages(parsed: Iterator[ParsedXlsx], cache: Optional[ParseCache] = None,
+                            report: Optional["RunReport"] = None) -> Dict[int, Dict[int, MonthStore]]:
+  # parsedはkeep_errors=Trueで作り、解析できなかったファイルもファイル名を表示してからエラーにする
+  listen_diary_pages: Dict[int, Dict[int, MonthStore]] = {}
+  # 園児の名前はクラスごとに番号にまとめる
+  roster = ChildRoster()
+  try:
+    for xlsx_path, (dt, dump, warnings, stats) in parsed:
+      print(f" ----- {xlsx_path.name}を解析中 ----- ")
+      if dt is None or dump is None:
+        raise AppError(stats["error"])
+      if report is not None:
+        report.recordFile(xlsx_path, dt, warnings, stats)
+      if len(warnings) > 0:
+        print("解析を完了しましたが、以下の警告があります。")
+        for warning in warnings:
+          print(warning)
+      if dt.reiwa not in listen_diary_pages:
+        listen_diary_pages[dt.reiwa] = {}
+      if dt.month not in listen_diary_pages[dt.reiwa]:
+        listen_diary_pages[dt.reiwa][dt.month] = MonthStore(roster)
+      if dt.day in listen_diary_pages[dt.reiwa][dt.month]:
+        raise AppError(f"エラー: 令和{dt.reiwa}年{dt.month}月{dt.day}日の日誌が重複しています。")
+      listen_diary_pages[dt.reiwa][dt.month].add(dt.day, dump)
+  finally:
+    if cache is not None:
+      cache.save()
   return listen_diary_pages
 
-def createSaveData(reiwa: int, month: int, day_savedata_map: Dict[int, List[Any]]) -> List[Optional[List[Any]]]:
+def loadListenDiaryPages(xlsx_paths: List[Union[Path, ArchiveMember]], workers: int = 1, engine: str = XLSX_ENGINE,
+                         cache: Optional[ParseCache] = None, executor: Optional["ProcessPoolExecutor"] = None,
+                         report: Optional["RunReport"] = None) -> Dict[int, Dict[int, MonthStore]]:
+  # executorを渡した場合はそのプロセスプールを使い、終了処理は呼び出し側に任せる
+  workers = min(resolveWorkers(workers), max(len(xlsx_paths), 1))
+  own_executor: Optional["ProcessPoolExecutor"] = None
+  if executor is None and workers > 1:
+    executor = own_executor = createProcessPool(workers)
+  try:
+    trace_memory = report is not None and report.trace_memory
+    parsed = parseXlsxFiles(xlsx_paths, workers, engine, cache, executor, trace_memory, keep_errors=True)
+    return collectListenDiaryPages(parsed, cache, report)
+  finally:
+    if own_executor is not None:
+      own_executor.shutdown(wait=True, cancel_futures=True)
+
+def readXlsxDates(xlsx_paths: Iterable[Union[Path, ArchiveMember]], engine: str = XLSX_ENGINE,
+                  cache: Optional[ParseCache] = None) -> Tuple[Dict[Union[Path, ArchiveMember], ReiwaDate], List[str]]:
+  # 日付を読めなかったファイルはエラーとしてまとめて返す (datesは読めたファイルを入力順に並べる)
+  errors: List[str] = []
+  dates: Dict[Union[Path, ArchiveMember], ReiwaDate] = {}
+  for xlsx_path in xlsx_paths:
+    hit = cache.get(xlsx_path) if cache is not None else None
+    try:
+      dates[xlsx_path] = hit[0] if hit is not None else readXlsxDate(xlsx_path, engine)
+    except AppError as e:
+      errors.append(f"{xlsx_path.name}: {e.message}")
+  if cache is not None:
+    cache.save()
+  return dates, errors
+
+def prescanXlsxDates(xlsx_paths: Iterable[Union[Path, ArchiveMember]], klass: str, engine: str = XLSX_ENGINE,
+                     cache: Optional[ParseCache] = None, io_workers: int = STORAGE_IO_WORKERS,
+                     check_storage: bool = True) -> Dict[Union[Path, ArchiveMember], ReiwaDate]:
+  """全ファイルの日付だけを先に読み、重複やストレージとの衝突をまとめて報告する
+  check_storageがFalseなら、ストレージとの衝突は確かめない (統合のときに中身を比べる場合)"""
+  dates, errors = readXlsxDates(xlsx_paths, engine, cache)
+  files_by_date: Dict[ReiwaDate, List[Union[Path, ArchiveMember]]] = {}
+  for xlsx_path, dt in dates.items():
+    files_by_date.setdefault(dt, []).append(xlsx_path)
+  for dt, paths in files_by_date.items():
+    if len(paths) > 1:
+      names = ", ".join(path.name for path in paths)
+      errors.append(f"エラー: 令和{dt.reiwa}年{dt.month}月{dt.day}日の日誌が重複しています。({names})")
+  # (令和年度, 月)ごとに、ストレージですでに埋まっている日のビットマップを作る
+  reiwa_months = sorted({(dt.reiwa, dt.month) for dt in files_by_date}) if check_storage else []
+  occupancy: Dict[Tuple[int, int], int] = {}
+  for reiwa_month, existing_data in iterMonthlySaves(STORAGE_DIR_PATH, klass, reiwa_months, io_workers):
+    occupancy[reiwa_month] = dayOccupancy(existing_data)
+  for dt in sorted(files_by_date, key=lambda d: (d.reiwa, d.month, d.day)) if check_storage else []:
+    if occupancy[(dt.reiwa, dt.month)] >> (dt.day - 1) & 1:
+      names = ", ".join(path.name for path in files_by_date[dt])
+      errors.append(f"エラー: 令和{dt.reiwa}年{dt.month}月{dt.day}日のデータはストレージにすでに存在します。({names})")
+  if len(errors) > 0:
+    raise AppError("事前確認で以下のエラーが見つかりました。\n" + "\n".join(errors))
+  return dates
+
+def createSaveData(reiwa: int, month: int, day_savedata_map: Union[Dict[int, Any], MonthStore]) -> List[Optional[List[Any]]]:
   save_data: List[Optional[List[Any]]] = [None] * getNumberOfDays(reiwa, month)
   for day in day_savedata_map:
     save_data[day - 1] = day_savedata_map[day]
   return save_data
 
-def margeSaveData(a: List[Optional[List[Any]]], b: List[Optional[List[Any]]]) -> List[Optional[List[Any]]]:
-  if len(a) != len(b):
+def mergeMonthlySave(existing_data: List[Optional[List[Any]]], day_savedata_map: Union[Dict[int, List[Any]], MonthStore],
+                     policy: str = MERGE_POLICY) -> Tuple[List[Optional[List[Any]]], List[int]]:
+  """保存済みの月のデータにエクセルファイルの日を統合し、(統合したデータ, 衝突した日のリスト)を返す
+  衝突した日は保存済みのデータのまま残す"""
+  if policy not in MERGE_POLICIES:
+    raise ValueError(f"不明な統合の方法です。: {policy}")
+  merged = list(existing_data)
+  conflicts: List[int] = []
+  # 新しいデータのある日だけを見る
+  for day in sorted(day_savedata_map):
+    existing_day = merged[day - 1]
+    if existing_day is None or policy == "overwrite":
+      merged[day - 1] = day_savedata_map[day]
+    elif policy == "keep":
+      continue
+    elif policy == "error" or existing_day != day_savedata_map[day]:
+      conflicts.append(day)
+  return merged, conflicts
+
+def findMergeConflicts(existing_data: Optional[List[Optional[List[Any]]]], day_savedata_map: Union[Dict[int, List[Any]], MonthStore],
+                       policy: str = MERGE_POLICY) -> List[int]:
+  # 統合したデータは作らずに、衝突する日だけを調べる
+  if existing_data is None or policy in ("keep", "overwrite"):
+    return []
+  conflicts: List[int] = []
+  for day in sorted(day_savedata_map):
+    existing_day = existing_data[day - 1]
+    if existing_day is not None and (policy == "error" or existing_day != day_savedata_map[day]):
+      conflicts.append(day)
+  return conflicts
+
+def mergeConflictMessage(conflicts: List[Tuple[int, int, List[int]]], policy: str = MERGE_POLICY) -> str:
+  reason = "すでに存在します" if policy == "error" else "すでに存在し、内容が異なります"
+  lines = [f"エラー: 令和{reiwa}年{month}月の{formatDays(days)}のデータはストレージに{reason}。" for reiwa, month, days in sorted(conflicts)]
+  lines.append("(保存済みの日の扱いは--merge-policyで変更できます)")
+  return "\n".join(lines)
+
+def buildMonthlySave(reiwa: int, month: int, day_savedata_map: Union[Dict[int, List[Any]], MonthStore],
+                     existing_data: Optional[List[Optional[List[Any]]]], policy: str = MERGE_POLICY) -> List[Optional[List[Any]]]:
+  if existing_data is None:
+    return createSaveData(reiwa, month, day_savedata_map)
+  if len(existing_data) != getNumberOfDays(reiwa, month):
     raise ValueError("リストの長さが異なります。")
-  marged: List[Optional[List[Any]]] = [None] * len(a)
-  for i in range(len(marged)):
-    if a[i] is not None and b[i] is not None:
-      raise AppError(f"エラー: {i+1}日のデータが重複しています。")
-    elif a[i] is not None:
-      marged[i] = a[i]
-    elif b[i] is not None:
-      marged[i] = b[i]
-  return marged
-  
-def main():
-  checkPathsExistence()
-  klass: str = loadKlassName(KLASS_NAME_FILE_PATH)
-  
-  xlsx_path_list: List[Path] = []
-  # list existing xlsx files in DIR_PATH
-  for path in DIR_PATH.iterdir():
-    if path.suffix == ".xlsx":
-      xlsx_path_list.append(path.resolve())
-  print("=== === === === === エクセルファイル読み込み中 === === === === ===\n")
-  listen_diary_pages = loadListenDiaryPages(xlsx_path_list)
-  
-  save_data_map: Dict[int, Dict[int, List[Optional[List[Any]]]]] = {}
+  merged, conflicts = mergeMonthlySave(existing_data, day_savedata_map, policy)
+  if len(conflicts) > 0:
+    raise AppError(mergeConflictMessage([(reiwa, month, conflicts)], policy))
+  return merged
+
+def saveMonth(journal: RestoreJournal, reiwa: int, klass: str, month: int, save_data: List[Optional[List[Any]]],
+              compact: bool = False, report: Optional["RunReport"] = None):
+  # 書き込みはjournal.commit()で確定する
+  print(f" ----- 令和{reiwa}年{month}月のデータを保存中 ----- ")
+  with RunReport.measure(report, "write", f"{reiwa}/{klass}/{month}.json"):
+    written = journal.stage(klass, reiwa, month, save_data, compact)
+  if not written:
+    print("保存済みのデータと同じ内容のため、書き込みを省略しました。")
+
+def checkListenDiaryPages(listen_diary_pages: Dict[int, Dict[int, MonthStore]], klass: str, args: argparse.Namespace
+                          ) -> Tuple[Dict[Tuple[int, int], Optional[List[Optional[List[Any]]]]], List[Tuple[int, int, List[int]]]]:
+  """保存済みの月のデータを読み、(月 -> 保存済みのデータ, 衝突した(令和年度, 月, 日のリスト))を返す"""
+  existing_data_map: Dict[Tuple[int, int], Optional[List[Optional[List[Any]]]]] = {}
+  conflicts: List[Tuple[int, int, List[int]]] = []
   
   print(f"\n=== === === === === 新しいデータの作成中 === === === === ===\n")
+  reiwa_months = [(reiwa, month) for reiwa in listen_diary_pages for month in listen_diary_pages[reiwa]]
+  for (reiwa, month), existing_data in iterMonthlySaves(STORAGE_DIR_PATH, klass, reiwa_months, args.io_workers):
+    print(f" ----- 令和{reiwa}年{month}月のデータを作成中 ----- ")
+    # 保存する前に全部の月の衝突を確かめてまとめて報告し、ダンプの組み立ては保存する月ごとに行う
+    month_conflicts = findMergeConflicts(existing_data, listen_diary_pages[reiwa][month], args.merge_policy)
+    if len(month_conflicts) > 0:
+      conflicts.append((reiwa, month, month_conflicts))
+    existing_data_map[(reiwa, month)] = existing_data
+  return existing_data_map, conflicts
+
+def saveListenDiaryPages(listen_diary_pages: Dict[int, Dict[int, MonthStore]], klass: str, args: argparse.Namespace,
+                         journal: RestoreJournal, existing_data_map: Dict[Tuple[int, int], Optional[List[Optional[List[Any]]]]],
+                         report: Optional["RunReport"] = None):
+  # 一時ファイルに書くだけで、置き換えは呼び出し側のjournal.commit()で行う
+  print(f"\n=== === === === === データの保存中 === === === === ===\n")
+  reiwa_months = [(reiwa, month) for reiwa in listen_diary_pages for month in listen_diary_pages[reiwa]]
+  for reiwa, month in reiwa_months:
+    with RunReport.measure(report, "merge", f"{reiwa}/{klass}/{month}.json"):
+      save_data = buildMonthlySave(reiwa, month, listen_diary_pages[reiwa][month], existing_data_map.pop((reiwa, month)),
+                                   args.merge_policy)
+    saveMonth(journal, reiwa, klass, month, save_data, args.compact, report)
+
+def restoreStreaming(xlsx_paths: Iterable[Union[Path, ArchiveMember]], dates: Dict[Union[Path, ArchiveMember], ReiwaDate], klass: str,
+                     args: argparse.Namespace, journal: RestoreJournal, cache: Optional[ParseCache] = None,
+                     executor: Optional["ProcessPoolExecutor"] = None,
+                     report: Optional["RunReport"] = None) -> List[Tuple[int, int, List[int]]]:
+  """(令和年度, 月)ごとに解析・統合・保存を済ませていくので、メモリ使用量はひと月分で収まる
+  保存済みの日と衝突する月は保存せずに続け、衝突した(令和年度, 月, 日のリスト)をまとめて返す"""
+  conflicts: List[Tuple[int, int, List[int]]] = []
+  groups: Dict[Tuple[int, int], List[Union[Path, ArchiveMember]]] = {}
+  for xlsx_path in xlsx_paths:
+    dt = dates[xlsx_path]
+    groups.setdefault((dt.reiwa, dt.month), []).append(xlsx_path)
+  reiwa_months = sorted(groups)
+  workers = resolveWorkers(args.workers)
+  # 先読みは次の月までに抑える
+  for (reiwa, month), existing_data in iterMonthlySaves(STORAGE_DIR_PATH, klass, reiwa_months, args.io_workers, window=2):
+    print(f"\n=== === === === === 令和{reiwa}年{month}月を復元中 === === === === ===\n")
+    listen_diary_pages = loadListenDiaryPages(groups[(reiwa, month)], workers, args.engine, cache, executor, report)
+    for parsed_reiwa in listen_diary_pages:
+      for parsed_month in listen_diary_pages[parsed_reiwa]:
+        if (parsed_reiwa, parsed_month) != (reiwa, month):
+          raise AppError(f"エラー: 令和{parsed_reiwa}年{parsed_month}月の日誌が令和{reiwa}年{month}月として読み込まれました。")
+    month_conflicts = findMergeConflicts(existing_data, listen_diary_pages[reiwa][month], args.merge_policy)
+    if len(month_conflicts) > 0:
+      # この月は保存せず、--resumeで再実行したときにもう一度復元する
+      print(f"令和{reiwa}年{month}月は保存済みのデータと衝突するため、保存しませんでした。")
+      conflicts.append((reiwa, month, month_conflicts))
+      continue
+    with RunReport.measure(report, "merge", f"{reiwa}/{klass}/{month}.json"):
+      save_data = buildMonthlySave(reiwa, month, listen_diary_pages[reiwa][month], existing_data, args.merge_policy)
+    del listen_diary_pages
+    # 月ごとに確定するので、中断しても--resumeでこの次の月から再開できる
+    saveMonth(journal, reiwa, klass, month, save_data, args.compact, report)
+    journal.commit()
+  return conflicts
+
+class WarmMonthlySaves:
+  """監視モードで、保存済みの月のデータをメモリに持ち続ける (ファイルが外から変更されていたら読み直す)"""
+  def __init__(self, storage_path: Path, klass: str) -> None:
+    self.storage_path = storage_path
+    self.klass = klass
+    # (令和年度, 月) -> ((サイズ, 更新時刻), 月のデータ)
+    self.months: Dict[Tuple[int, int], Tuple[Optional[Tuple[int, int]], Optional[List[Optional[List[Any]]]]]] = {}
+
+  def stamp(self, reiwa: int, month: int) -> Optional[Tuple[int, int]]:
+    try:
+      file_stat = monthlySavePath(self.storage_path, reiwa, self.klass, month).stat()
+    except FileNotFoundError:
+      return None
+    return file_stat.st_size, file_stat.st_mtime_ns
+
+  def get(self, reiwa: int, month: int) -> Optional[List[Optional[List[Any]]]]:
+    stamp = self.stamp(reiwa, month)
+    known = self.months.get((reiwa, month))
+    if known is not None and known[0] == stamp:
+      return known[1]
+    existing_data = loadExistingMonthlySave(self.storage_path, reiwa, self.klass, month)
+    self.months[(reiwa, month)] = (stamp, existing_data)
+    return existing_data
+
+  def put(self, reiwa: int, month: int, save_data: List[Optional[List[Any]]]):
+    self.months[(reiwa, month)] = (self.stamp(reiwa, month), save_data)
+
+def scanXlsxFiles(dir_path: Path) -> Dict[Union[Path, ArchiveMember], Tuple[int, int]]:
+  # 通常の復元と同じくフォルダの下やzipファイルの中もたどる (zipファイルの中のファイルはzipファイルの大きさと更新時刻を使う)
+  # コピー中で開けないzipファイルは、次の確認のときにもう一度見る
+  found: Dict[Union[Path, ArchiveMember], Tuple[int, int]] = {}
+  for xlsx_path in iterXlsxPaths(dir_path, skip_broken_archives=True):
+    try:
+      file_stat = xlsx_path.stat()
+    except FileNotFoundError:
+      continue
+    found[xlsx_path] = (file_stat.st_size, file_stat.st_mtime_ns)
+  return found
+
+def restoreIncrement(xlsx_paths: List[Union[Path, ArchiveMember]], klass: str, args: argparse.Namespace, journal: RestoreJournal,
+                     warm: WarmMonthlySaves, cache: Optional[ParseCache] = None,
+                     executor: Optional["ProcessPoolExecutor"] = None, report: Optional["RunReport"] = None):
+  """新しく届いたファイルだけを解析し、関係する月のファイルにだけ統合する
+  解析できないファイルや衝突のある月は報告して飛ばし、残りは保存する"""
+  trace_memory = report is not None and report.trace_memory
+  parsed = list(parseXlsxFiles(xlsx_paths, resolveWorkers(args.workers), args.engine, cache, executor,
+                              trace_memory, keep_errors=True, close_archives=True))
+  for xlsx_path, (dt, _, _, stats) in parsed:
+    if dt is None:
+      print(f"{xlsx_path.name}: {stats['error']}")
+  parsed = [(xlsx_path, result) for xlsx_path, result in parsed if result[0] is not None]
+  listen_diary_pages = collectListenDiaryPages(iter(parsed), cache, report)
+  saved: List[Tuple[int, int, List[Optional[List[Any]]]]] = []
   for reiwa in listen_diary_pages:
     for month in listen_diary_pages[reiwa]:
-      print(f" ----- 令和{reiwa}年{month}月のデータを作成中 ----- ")
-      xlsx_parsed_data = createSaveData(reiwa, month, listen_diary_pages[reiwa][month])
-      existing_data_path = STORAGE_DIR_PATH.joinpath(str(reiwa), klass, f"{month}.json")
-      existing_data: Optional[List[Optional[List[Any]]]] = None
-      if existing_data_path.exists() and os.path.getsize(existing_data_path) > 0:
-        with open(str(existing_data_path), "r", encoding="utf-8") as f:
-          existing_data = json.load(f)
-      if reiwa not in save_data_map:
-        save_data_map[reiwa] = {}
-      if existing_data is not None:
-        marged = margeSaveData(existing_data, xlsx_parsed_data)
-        save_data_map[reiwa][month] = marged
+      try:
+        with RunReport.measure(report, "merge", f"{reiwa}/{klass}/{month}.json"):
+          save_data = buildMonthlySave(reiwa, month, listen_diary_pages[reiwa][month], warm.get(reiwa, month), args.merge_policy)
+      except AppError as e:
+        print(e.message)
+        continue
+      saveMonth(journal, reiwa, klass, month, save_data, args.compact, report)
+      saved.append((reiwa, month, save_data))
+  journal.commit()
+  for reiwa, month, save_data in saved:
+    warm.put(reiwa, month, save_data)
+
+def watchRestore(klass: str, args: argparse.Namespace, journal: RestoreJournal, cache: Optional[ParseCache] = None,
+                 executor: Optional["ProcessPoolExecutor"] = None, report: Optional["RunReport"] = None):
+  """エクセルリストを定期的に確認し、新しいファイルや変更されたファイルを届いた分だけ復元する (Ctrl+Cで終了)"""
+  warm = WarmMonthlySaves(STORAGE_DIR_PATH, klass)
+  # ファイル -> 復元したときの(サイズ, 更新時刻)
+  restored: Dict[Union[Path, ArchiveMember], Tuple[int, int]] = {}
+  # ファイル -> (最後に見た(サイズ, 更新時刻), その状態を最初に見た時刻)
+  pending: Dict[Union[Path, ArchiveMember], Tuple[Tuple[int, int], float]] = {}
+  print(f"=== === === === === エクセルリストを監視中 (Ctrl+Cで終了) === === === === ===\n")
+  try:
+    while True:
+      now = time.monotonic()
+      scanned = scanXlsxFiles(DIR_PATH)
+      for xlsx_path, stamp in scanned.items():
+        if restored.get(xlsx_path) == stamp:
+          continue
+        known = pending.get(xlsx_path)
+        if known is None or known[0] != stamp:
+          pending[xlsx_path] = (stamp, now)
+      # コピー中のファイルは、大きさと更新時刻がしばらく変わらず、エクセルファイルとして開けるようになるまで待つ
+      # (zipファイルの中のファイルは、zipファイルを開けた時点でコピーが終わっている)
+      settled = [xlsx_path for xlsx_path, (stamp, since) in pending.items()
+                 if now - since >= WATCH_SETTLE_SECONDS and (isinstance(xlsx_path, ArchiveMember) or zipfile.is_zipfile(xlsx_path))]
+      if len(settled) > 0:
+        start = time.perf_counter()
+        print(f"\n ----- {len(settled)}件のファイルを復元中 ----- ")
+        try:
+          restoreIncrement(settled, klass, args, journal, warm, cache, executor, report)
+        except AppError as e:
+          print(e.message)
+        finally:
+          # 監視中もエクセルリストのzipファイルを削除・置き換えできるよう、開いたままにしない
+          OPEN_ARCHIVES.close()
+        # 失敗したファイルも、変更されるまでは復元し直さない
+        for xlsx_path in settled:
+          restored[xlsx_path] = pending.pop(xlsx_path)[0]
+        print(f"{(time.perf_counter() - start) * 1000:.0f}ミリ秒で処理しました。監視を続けます。")
+      for xlsx_path in [xlsx_path for xlsx_path in pending if xlsx_path not in scanned]:
+        del pending[xlsx_path]
+      time.sleep(WATCH_INTERVAL_SECONDS)
+  except KeyboardInterrupt:
+    print("\n監視を終了しました。")
+
+def formatDays(days: List[int]) -> str:
+  return ", ".join(str(day) for day in days) + "日"
+
+def planRestore(xlsx_paths: Iterable[Union[Path, ArchiveMember]], klass: str, args: argparse.Namespace, cache: Optional[ParseCache] = None,
+                executor: Optional["ProcessPoolExecutor"] = None, report: Optional["RunReport"] = None) -> bool:
+  """ストレージには書き込まずに、(令和年度, 月)ごとの復元の計画と保存済みのデータとの違いを表示する
+  このまま復元してエラーにならないならTrueを返す"""
+  # 日付はヘッダーだけを読んで先に確かめ、関係する月のファイルを読み込んでおく
+  dates, errors = readXlsxDates(xlsx_paths, args.engine, cache)
+  reiwa_months = sorted({(dt.reiwa, dt.month) for dt in dates.values()})
+  existing_data_map = prefetchMonthlySaves(STORAGE_DIR_PATH, klass, reiwa_months, args.io_workers)
+
+  print("=== === === === === エクセルファイルの検証中 === === === === ===\n")
+  targets = list(dates)
+  trace_memory = report is not None and report.trace_memory
+  parsed = parseXlsxFiles(targets, resolveWorkers(args.workers), args.engine, cache, executor, trace_memory, keep_errors=True)
+  # 日付 -> "add" (追加), "same" (保存済みで同じ内容), "changed" (保存済みで内容が異なる)
+  kinds: Dict[ReiwaDate, str] = {}
+  files_by_date: Dict[ReiwaDate, List[Union[Path, ArchiveMember]]] = {}
+  file_warnings: List[Tuple[Union[Path, ArchiveMember], List[str]]] = []
+  try:
+    for xlsx_path, (dt, dump, warnings, stats) in parsed:
+      if dt is None:
+        errors.append(f"{xlsx_path.name}: {stats['error']}")
+        continue
+      if report is not None:
+        report.recordFile(xlsx_path, dt, warnings, stats)
+      if len(warnings) > 0:
+        file_warnings.append((xlsx_path, warnings))
+      files_by_date.setdefault(dt, []).append(xlsx_path)
+      # 保存済みの日だけダンプを比べ、比べたダンプは持ち続けない
+      existing_data = existing_data_map.get((dt.reiwa, dt.month))
+      if existing_data is None or existing_data[dt.day - 1] is None:
+        kinds[dt] = "add"
       else:
-        save_data_map[reiwa][month] = xlsx_parsed_data
+        kinds[dt] = "same" if existing_data[dt.day - 1] == dump else "changed"
+  finally:
+    if cache is not None:
+      cache.save()
+
+  print(f"\n=== === === === === {klass}の復元の計画 (保存は行いません) === === === === ===\n")
+  print(f"保存済みの日の扱い: {args.merge_policy}\n")
+  for reiwa, month in reiwa_months:
+    existing_data = existing_data_map[(reiwa, month)]
+    if existing_data is None:
+      state = "新規作成"
+    else:
+      state = f"保存済み{sum(day_data is not None for day_data in existing_data)}日分"
+    print(f" ----- 令和{reiwa}年{month}月 ({reiwa}/{klass}/{month}.json: {state}) ----- ")
+    month_dates = sorted((dt for dt in kinds if (dt.reiwa, dt.month) == (reiwa, month)), key=lambda dt: dt.day)
+    for label, kind in (("追加する日", "add"), ("保存済みで同じ内容の日", "same"), ("保存済みで内容が異なる日", "changed")):
+      days = [dt.day for dt in month_dates if kinds[dt] == kind]
+      if len(days) > 0:
+        print(f"{label}: {formatDays(days)}")
+    for dt in month_dates:
+      if len(files_by_date[dt]) > 1:
+        names = ", ".join(path.name for path in files_by_date[dt])
+        print(f"日誌が重複している日: {dt.day}日 ({names})")
+
+  if len(file_warnings) > 0:
+    print(f"\n=== === === === === 警告のあるファイル === === === === ===\n")
+    for xlsx_path, warnings in file_warnings:
+      print(f" ----- {xlsx_path.name} (警告{len(warnings)}件) ----- ")
+      for warning in warnings:
+        print(warning)
+  if len(errors) > 0:
+    print(f"\n=== === === === === 解析できないファイル === === === === ===\n")
+    for error in errors:
+      print(error)
+
+  n_added = sum(kind == "add" for kind in kinds.values())
+  n_same = sum(kind == "same" for kind in kinds.values())
+  n_changed = sum(kind == "changed" for kind in kinds.values())
+  n_duplicated = sum(len(paths) > 1 for paths in files_by_date.values())
+  print(f"\n追加: {n_added}日, 保存済み: {n_same + n_changed}日 (うち内容が異なる日: {n_changed}日), "
+        f"日誌の重複: {n_duplicated}日, 解析できないファイル: {len(errors)}件")
+  n_conflicts = {"error": n_same + n_changed, "identical": n_changed}.get(args.merge_policy, 0)
+  ok = n_conflicts == 0 and n_duplicated == 0 and len(errors) == 0
+  print("このまま復元できます。" if ok else "このまま復元すると、エラーで中断されます。")
+  return ok
+
+def skipDoneMonths(xlsx_paths: List[Union[Path, ArchiveMember]], klass: str, journal: RestoreJournal, dates: Dict[Union[Path, ArchiveMember], ReiwaDate],
+                   engine: str = XLSX_ENGINE, cache: Optional[ParseCache] = None) -> List[Union[Path, ArchiveMember]]:
+  """前回の中断された復元で保存が済んだ月のファイルを除く (日付はヘッダーだけを読んで調べる)"""
+  if not any(done[0] == klass for done in journal.done):
+    return xlsx_paths
+  unknown = [xlsx_path for xlsx_path in xlsx_paths if xlsx_path not in dates]
+  known, _ = readXlsxDates(unknown, engine, cache)
+  dates.update(known)
+  # 日付を読めないファイルは残しておき、後の処理でエラーとして報告する
+  remaining = [xlsx_path for xlsx_path in xlsx_paths
+               if xlsx_path not in dates or not journal.isDone(klass, dates[xlsx_path].reiwa, dates[xlsx_path].month)]
+  n_months = len({(dates[xlsx_path].reiwa, dates[xlsx_path].month) for xlsx_path in xlsx_paths if xlsx_path not in remaining})
+  print(f"{klass}: 保存が済んでいる{n_months}か月分 ({len(xlsx_paths) - len(remaining)}件のファイル) を飛ばして再開します。")
+  return remaining
+
+def naturalSortKey(text: str) -> List[Union[str, int]]:
+  # 数字の部分は数として比べる (「4月/0401.xlsx」が「10月/1001.xlsx」より先になる)
+  return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", text)]
+
+def isXlsxName(name: str) -> bool:
+  # エクセルが開いている間に作るロックファイル (~$で始まる) は除く
+  return name.endswith(".xlsx") and not name.startswith("~$")
+
+def iterArchiveMembers(archive_path: Path, skip_broken: bool = False) -> Iterator[ArchiveMember]:
+  try:
+    with openZipArchive(archive_path) as zf:
+      members = [info.filename for info in zf.infolist()
+                 if not info.is_dir() and isXlsxName(posixpath.basename(info.filename)) and not info.filename.startswith("__MACOSX/")]
+  except (zipfile.BadZipFile, OSError):
+    if skip_broken:
+      return
+    raise AppError(f"エラー: {archive_path.name}はzipファイルとして読み込めません。")
+  for member in sorted(members, key=naturalSortKey):
+    yield ArchiveMember(archive_path, member)
+
+def iterXlsxPaths(dir_path: Path, skip_broken_archives: bool = False) -> Iterator[Union[Path, ArchiveMember]]:
+  """dir_pathの下のフォルダをたどり、エクセルファイルとzipファイルの中のエクセルファイルを見つけた順に返す
+  ファイル名の数字の順に並べるので、年/月のフォルダや日付のファイル名ならおおむね日付順になる
+  skip_broken_archivesがTrueなら、開けないzipファイルはエラーにせずに飛ばす"""
+  with os.scandir(dir_path) as scanned:
+    entries = sorted(scanned, key=lambda entry: naturalSortKey(entry.name))
+  for entry in entries:
+    if entry.is_dir():
+      yield from iterXlsxPaths(Path(entry.path), skip_broken_archives)
+    elif entry.is_file():
+      if isXlsxName(entry.name):
+        yield Path(entry.path).resolve()
+      elif entry.name.lower().endswith(".zip"):
+        yield from iterArchiveMembers(Path(entry.path).resolve(), skip_broken_archives)
+
+def listXlsxPaths(dir_path: Path) -> List[Union[Path, ArchiveMember]]:
+  return list(iterXlsxPaths(dir_path))
+
+def loadKlassManifest(manifest_path: Path) -> List[Tuple[str, str]]:
+  """クラス一覧.txtの`フォルダ名=クラス名`の行を読み、(フォルダ名, クラス名)のリストを返す"""
+  try:
+    with open(manifest_path, "r", encoding="utf-8") as f:
+      lines = f.read().splitlines()
+  except Exception as e:
+    raise AppError("クラス一覧.txtの読み込みに失敗しました。")
+  entries: List[Tuple[str, str]] = []
+  for line_number, line in enumerate(lines, 1):
+    line = line.strip()
+    if line == "" or line.startswith("#"):
+      continue
+    folder, separator, klass = line.partition("=")
+    folder = folder.strip()
+    klass = klass.strip()
+    if separator == "" or folder == "" or klass == "":
+      raise AppError(f"クラス一覧.txtの{line_number}行目は`フォルダ名=クラス名`の形式で記述してください。")
+    if not DIR_PATH.joinpath(folder).is_dir():
+      raise AppError(f"クラス一覧.txtの{line_number}行目: エクセルリストに{folder}フォルダが存在しません。")
+    if klass in [entry[1] for entry in entries]:
+      raise AppError(f"クラス一覧.txtの{line_number}行目: {klass}が重複しています。")
+    entries.append((folder, klass))
+  if len(entries) == 0:
+    raise AppError("クラス一覧.txtにはフォルダ名とクラス名を記述してください。")
+  return entries
+
+def parseArgs(argv: Optional[List[str]] = None) -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description="エクセルリストの日誌をストレージに復元します。")
+  parser.add_argument("-j", "--workers", type=int, default=PARSE_WORKERS,
+                      help="エクセルファイルを並列に解析するプロセス数 (1なら逐次処理、0ならCPUコア数)")
+  parser.add_argument("--engine", choices=XLSX_ENGINES, default=XLSX_ENGINE,
+                      help="エクセルファイルの読み込みエンジン (nativeで読めないファイルはopenpyxlで読み直します)")
+  parser.add_argument("--no-prescan", dest="prescan", action="store_false", default=PRESCAN_ENABLED,
+                      help="日付の事前確認を省略します")
+  parser.add_argument("--io-workers", type=int, default=STORAGE_IO_WORKERS,
+                      help="ストレージの月のファイルを並行して読み込むスレッド数")
+  parser.add_argument("--stream", action="store_true", default=STREAM_RESTORE,
+                      help="月ごとに解析・保存を進め、メモリ使用量をひと月分に抑えます (数年分の復元向け)")
+  parser.add_argument("--multi", action="store_true",
+                      help="クラス一覧.txtに従い、エクセルリスト内のフォルダごとに複数のクラスをまとめて復元します")
+  parser.add_argument("--merge-policy", choices=MERGE_POLICIES, default=MERGE_POLICY,
+                      help="ストレージにすでにデータがある日の扱い (error: エラー, keep: 保存済みを残す, "
+                           "overwrite: 上書き, identical: 同じ内容なら何もせず、異なればエラー)")
+  parser.add_argument("--mirror", action="store_true", default=MIRROR_ENABLED,
+                      help="保存した月の内容を、検索用のSQLiteデータベース (ミラー.sqlite3) にも反映します")
+  parser.add_argument("--absent", metavar="名前", default=None,
+                      help="復元は行わずに、ミラーからこの園児が欠席した日を検索して表示します")
+  parser.add_argument("--reason", default=None, help="--absentで、この欠席理由の日だけを表示します")
+  parser.add_argument("--reiwa", type=int, default=None, help="--absentで、この令和年度の日だけを表示します")
+  parser.add_argument("--stats", type=int, metavar="年度", default=None,
+                      help="復元は行わずに、この令和年度の出欠・欠席理由・排泄・食事・睡眠の集計を集計フォルダに書き出します")
+  parser.add_argument("--stats-format", choices=STATS_FORMATS, default=STATS_FORMATS[0], help="--statsで書き出す形式")
+  parser.add_argument("--export", type=int, metavar="年度", default=None,
+                      help="復元は行わずに、この令和年度のストレージのデータを1日1ファイルの日誌エクセルファイルとして書き出しフォルダに書き出します")
+  parser.add_argument("--verify", action="store_true",
+                      help="--exportで書き出したファイルを読み直し、ストレージのデータと一致するか確かめます")
+  parser.add_argument("--watch", action="store_true",
+                      help="終了せずにエクセルリストを監視し、新しく入れたファイルや変更したファイルをその都度復元します")
+  parser.add_argument("--resume", action="store_true",
+                      help="前回中断された復元のうち、保存が済んだ月を飛ばして続きから再開します")
+  parser.add_argument("--dry-run", action="store_true",
+                      help="ストレージには書き込まずに、月ごとの復元の計画と保存済みのデータとの違いを表示します")
+  parser.add_argument("--compact", action="store_true", default=COMPACT_JSON,
+                      help="月のデータを改行・インデントなしの小さい形式で保存します")
+  parser.add_argument("--report", type=Path, default=None,
+                      help="ファイルごと・段階ごとの処理時間と警告を、このファイルにJSONL形式で書き出します")
+  parser.add_argument("--trace-memory", action="store_true",
+                      help="実行レポートに、ファイルごとのメモリ確保量のピークも記録します (処理は遅くなります)")
+  parser.add_argument("--profile", type=Path, default=None,
+                      help="cProfileの計測結果をこのファイルに書き出します (メインプロセスのみ)")
+  parser.add_argument("--no-cache", dest="cache", action="store_false", default=PARSE_CACHE_ENABLED,
+                      help="解析キャッシュを使わずに、すべてのエクセルファイルを解析し直します")
+  return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None):
+  args = parseArgs(argv)
+  report = RunReport(args.report, args.trace_memory) if args.report is not None else None
+  profiler = None
+  if args.profile is not None:
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+  try:
+    restore(args, report)
+  finally:
+    if profiler is not None:
+      profiler.disable()
+      profiler.dump_stats(str(args.profile))
+    if report is not None:
+      report.close()
+
+def queryAbsences(args: argparse.Namespace):
+  if not STORAGE_DIR_PATH.exists():
+    raise AppError("ストレージフォルダが存在しません。")
+  mirror = StorageMirror(MIRROR_DB_PATH)
+  try:
+    # 前回から変わった月だけを写し直してから検索する
+    mirror.sync(STORAGE_DIR_PATH)
+    absences = mirror.findAbsences(args.absent, args.reason, args.reiwa)
+  finally:
+    mirror.close()
+  for klass, reiwa, month, day, abs_reason in absences:
+    print(f"令和{reiwa}年{month}月{day}日 ({klass}): {abs_reason if abs_reason is not None else '欠席理由なし'}")
+  print(f"\n{args.absent}の欠席: {len(absences)}日")
+
+def exportStats(args: argparse.Namespace):
+  if not STORAGE_DIR_PATH.exists():
+    raise AppError("ストレージフォルダが存在しません。")
+  if args.multi:
+    klasses = [klass for _, klass in loadKlassManifest(KLASS_MANIFEST_FILE_PATH)]
+  else:
+    klasses = [loadKlassName(KLASS_NAME_FILE_PATH)]
+  STATS_DIR_PATH.mkdir(exist_ok=True)
+  mirror = StorageMirror(MIRROR_DB_PATH)
+  try:
+    # ミラーを集計の読み込みのキャッシュとして使い、前回から変わった月だけを読み直す
+    mirror.sync(STORAGE_DIR_PATH)
+    for klass in klasses:
+      year = KlassYearCodes.load(mirror, klass, args.stats)
+      if len(year.days) == 0:
+        raise AppError(f"エラー: 令和{args.stats}年度の{klass}のデータがストレージにありません。")
+      tables = statsTables(year, aggregateKlassYear(year))
+      for out_path in exportStatsTables(tables, STATS_DIR_PATH.joinpath(f"{klass}_令和{args.stats}年度"), args.stats_format):
+        print(f"{out_path.name}を書き出しました。")
+  finally:
+    mirror.close()
+
+def exportStorage(args: argparse.Namespace):
+  """ストレージの1年度分のデータを、1日1ファイルの日誌エクセルファイルに書き出す"""
+  if not STORAGE_DIR_PATH.exists():
+    raise AppError("ストレージフォルダが存在しません。")
+  if args.multi:
+    klasses = [klass for _, klass in loadKlassManifest(KLASS_MANIFEST_FILE_PATH)]
+  else:
+    klasses = [loadKlassName(KLASS_NAME_FILE_PATH)]
+  reiwa: int = args.export
+  xlsx_paths: List[Path] = []
+  dts: List[ReiwaDate] = []
+  dumps: List[List[Any]] = []
+  for klass in klasses:
+    out_dir = EXPORT_DIR_PATH.joinpath(klass, f"令和{reiwa}年度")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for (_, month), save_data in iterMonthlySaves(STORAGE_DIR_PATH, klass, [(reiwa, month) for month in NENDO_MONTHS], args.io_workers):
+      for day, day_data in enumerate(save_data or [], 1):
+        if day_data is not None:
+          xlsx_paths.append(out_dir.joinpath(f"{month:02d}月{day:02d}日.xlsx"))
+          dts.append(ReiwaDate(reiwa, month, day))
+          dumps.append(day_data)
+  if len(xlsx_paths) == 0:
+    raise AppError(f"エラー: 令和{reiwa}年度のデータがストレージにありません。")
+  print(f"{len(xlsx_paths)}日分の日誌を書き出し中...")
+  workers = min(resolveWorkers(args.workers), len(xlsx_paths))
+  export = partial(exportDiaryDay, verify=args.verify, engine=args.engine)
+  if workers > 1:
+    with createProcessPool(workers) as executor:
+      errors = list(executor.map(export, xlsx_paths, dts, dumps, chunksize=max(1, len(xlsx_paths) // (workers * 4))))
+  else:
+    errors = list(map(export, xlsx_paths, dts, dumps))
+  mismatches = [error for error in errors if error is not None]
+  print(f"{len(xlsx_paths) - len(mismatches)}件の日誌エクセルファイルを{EXPORT_DIR_PATH.name}フォルダに書き出しました。")
+  if len(mismatches) > 0:
+    raise AppError("\n".join(mismatches))
+
+def restore(args: argparse.Namespace, report: Optional["RunReport"] = None):
+  if args.export is not None:
+    exportStorage(args)
+    return
+  if args.absent is not None:
+    queryAbsences(args)
+    return
+  if args.stats is not None:
+    exportStats(args)
+    return
+  if args.watch and (args.multi or args.dry_run):
+    raise AppError("エラー: --watchは--multi・--dry-runと一緒には使えません。")
+  checkPathsExistence(args.multi)
+  # 事前確認・試し実行・月ごとの復元・再開では全部のファイルが先に要るが、それ以外では見つけたファイルから解析を始める
+  # (監視モードでは、ここで見つけたファイルは使わない)
+  needs_all = (args.prescan and not args.watch) or args.dry_run or args.stream or args.resume
+  findXlsxPaths = listXlsxPaths if needs_all else iterXlsxPaths
+  klass_inputs: List[Tuple[str, Iterable[Union[Path, ArchiveMember]]]] = []
+  if args.multi:
+    for folder, klass in loadKlassManifest(KLASS_MANIFEST_FILE_PATH):
+      klass_inputs.append((klass, findXlsxPaths(DIR_PATH.joinpath(folder))))
+  else:
+    klass = loadKlassName(KLASS_NAME_FILE_PATH)
+    klass_inputs.append((klass, findXlsxPaths(DIR_PATH)))
   
-  print(f"\n=== === === === === データの保存中 === === === === ===\n")
-  for reiwa in save_data_map:
-    for month in save_data_map[reiwa]:
-      print(f" ----- 令和{reiwa}年{month}月のデータを保存中 ----- ")
-      dumped = json.dumps(save_data_map[reiwa][month], ensure_ascii=False, indent=5)
-      if not STORAGE_DIR_PATH.joinpath(str(reiwa)).exists():
-        STORAGE_DIR_PATH.joinpath(str(reiwa)).mkdir()
-      if not STORAGE_DIR_PATH.joinpath(str(reiwa), klass).exists():
-        STORAGE_DIR_PATH.joinpath(str(reiwa), klass).mkdir()
-        for i in range(1, 13):
-          STORAGE_DIR_PATH.joinpath(str(reiwa), klass, f"{i}.json").touch()
-      file_path = STORAGE_DIR_PATH.joinpath(str(reiwa), klass, f"{month}.json")
-      if not file_path.exists():
-        raise FileNotFoundError(f"令和{reiwa}年{month}月のデータが存在しません。")
-      with open(str(file_path), "w", encoding="utf-8") as f:
-        f.write(dumped)
+  cache = ParseCache(CACHE_DIR_PATH) if args.cache else None
+  mirror = StorageMirror(MIRROR_DB_PATH) if args.mirror and not args.dry_run else None
+  journal = RestoreJournal(STORAGE_DIR_PATH, mirror)
+  if args.dry_run:
+    if journal.exists():
+      print("前回の復元は途中で中断されています。試し実行ではそのままにし、通常の実行の最初に復旧します。\n")
+  else:
+    journal.recover()
+    if args.resume:
+      for i, (klass, xlsx_path_list) in enumerate(klass_inputs):
+        klass_inputs[i] = (klass, skipDoneMonths(list(xlsx_path_list), klass, journal, {}, args.engine, cache))
+    elif len(journal.done) > 0:
+      print("(--resumeを付けて実行すると、保存が済んだ月を飛ばして続きから再開します)\n")
+    journal.open(args.resume)
+  completed = False
+  try:
+    if mirror is not None:
+      # 日誌アプリで変更された月も含め、ミラーをストレージに追いつかせておく
+      mirror.sync(STORAGE_DIR_PATH)
+    restoreKlasses(args, klass_inputs, journal, cache, report)
+    completed = True
+  finally:
+    if not args.dry_run:
+      journal.close(completed)
+    if mirror is not None:
+      mirror.close()
+
+def restoreKlasses(args: argparse.Namespace, klass_inputs: List[Tuple[str, Iterable[Union[Path, ArchiveMember]]]], journal: RestoreJournal,
+                   cache: Optional[ParseCache] = None, report: Optional["RunReport"] = None):
+  dates: Dict[str, Dict[Union[Path, ArchiveMember], ReiwaDate]] = {}
+  # 試し実行では、事前確認の内容も計画の中で表示する (監視モードでは届いたファイルごとに確かめる)
+  if args.prescan and not args.dry_run and not args.watch:
+    print("=== === === === === 日付の事前確認中 === === === === ===\n")
+    # 全クラスの問題をまとめて報告する
+    errors: List[str] = []
+    for klass, xlsx_path_list in klass_inputs:
+      try:
+        with RunReport.measure(report, "prescan", klass):
+          # errorのとき以外は、保存済みの日との衝突を中身を比べて判断するので、ここでは確かめない
+          dates[klass] = prescanXlsxDates(xlsx_path_list, klass, args.engine, cache, args.io_workers,
+                                          check_storage=args.merge_policy == "error")
+      except AppError as e:
+        errors.append(f"[{klass}] {e.message}" if args.multi else e.message)
+    if len(errors) > 0:
+      raise AppError("\n".join(errors))
+  
+  workers = resolveWorkers(args.workers)
+  executor = createProcessPool(workers) if workers > 1 else None
+  try:
+    if args.watch:
+      watchRestore(klass_inputs[0][0], args, journal, cache, executor, report)
+      return
+    if args.dry_run:
+      failed: List[str] = []
+      for klass, xlsx_path_list in klass_inputs:
+        if not planRestore(xlsx_path_list, klass, args, cache, executor, report):
+          failed.append(klass)
+      print("\n\n試し実行のため、ストレージには何も保存していません。\n")
+      # 復元の前の確認としてスクリプトから使えるよう、このまま復元するとエラーになるなら失敗として終える
+      if len(failed) > 0:
+        raise AppError(f"エラー: {', '.join(failed)}はこのまま復元するとエラーで中断されます。")
+      return
+    if args.stream:
+      conflict_errors: List[str] = []
+      for klass, xlsx_path_list in klass_inputs:
+        if klass not in dates:
+          dates[klass], errors = readXlsxDates(xlsx_path_list, args.engine, cache)
+          if len(errors) > 0:
+            raise AppError("\n".join(errors))
+        if args.multi:
+          print(f"\n=== === === === === {klass}の復元中 === === === === ===\n")
+        conflicts = restoreStreaming(xlsx_path_list, dates[klass], klass, args, journal, cache, executor, report)
+        if len(conflicts) > 0:
+          message = mergeConflictMessage(conflicts, args.merge_policy)
+          conflict_errors.append(f"[{klass}] {message}" if args.multi else message)
+      # 全クラス・全月の衝突をまとめて報告する
+      if len(conflict_errors) > 0:
+        raise AppError("\n".join(conflict_errors))
+    else:
+      # 全クラスの解析を先にプロセスプールへ投入しておき、クラスごとに結果を受け取って保存する
+      trace_memory = report is not None and report.trace_memory
+      jobs = [parseXlsxFiles(xlsx_path_list, workers, args.engine, cache, executor, trace_memory, keep_errors=True)
+              for _, xlsx_path_list in klass_inputs]
+      # 全クラスの衝突を確かめてまとめて報告し、どのクラスも衝突しないときだけ保存する
+      loaded: List[Tuple[str, Dict[int, Dict[int, MonthStore]], Dict[Tuple[int, int], Optional[List[Optional[List[Any]]]]]]] = []
+      conflict_errors = []
+      for (klass, _), parsed in zip(klass_inputs, jobs):
+        if args.multi:
+          print(f"\n=== === === === === {klass}の復元中 === === === === ===\n")
+        print("=== === === === === エクセルファイル読み込み中 === === === === ===\n")
+        listen_diary_pages = collectListenDiaryPages(parsed, cache, report)
+        existing_data_map, conflicts = checkListenDiaryPages(listen_diary_pages, klass, args)
+        if len(conflicts) > 0:
+          message = mergeConflictMessage(conflicts, args.merge_policy)
+          conflict_errors.append(f"[{klass}] {message}" if args.multi else message)
+        loaded.append((klass, listen_diary_pages, existing_data_map))
+      if len(conflict_errors) > 0:
+        raise AppError("\n".join(conflict_errors))
+      for klass, listen_diary_pages, existing_data_map in loaded:
+        if args.multi:
+          print(f"\n=== === === === === {klass}の保存中 === === === === ===\n")
+        saveListenDiaryPages(listen_diary_pages, klass, args, journal, existing_data_map, report)
+      # すべてのクラスの月を書き切ってから、まとめて置き換える
+      journal.commit()
+  finally:
+    if executor is not None:
+      executor.shutdown(wait=True, cancel_futures=True)
+    OPEN_ARCHIVES.close()
 
   print("\n\n完了しました。\n")
 
@@ -3,5 +3,7 @@ chcp 65001
 cd %~dp0
 PATH=..\venv\Lib\site-packages\;%PATH%
 PATH=..\venv\Scripts\;%PATH%
-python main.py
-pause
\ No newline at end of file
+python main.py %*
+set RESULT=%errorlevel%
+pause
+exit /b %RESULT%
\ No newline at end of file